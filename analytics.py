@@ -0,0 +1,229 @@
+# analytics.py
+# Clinic numbers for the pharmacist: bookings per day and week, slot
+# utilization, cancellation and completion rates and the busiest timeslots.
+# They come from two small count tables in a local SQLite file, bookings per
+# (date, timeslot, status) and open slots per (date, timeslot). The data layer
+# reports every booking, appointment change and slot added or removed here,
+# and each report adjusts a few counts. The tables are rebuilt from the sheets
+# in one pandas group-by only when the file is new, after an update failed,
+# when a reload of Appointment or Schedule found changes this process didn't
+# make (another replica, or an edit in the spreadsheet), or every
+# ANALYTICS_REBUILD_SECONDS. Archived rows are counted too, so archiving
+# doesn't change the figures.
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+
+import sheet_cache
+
+ANALYTICS_PATH = st.secrets.get("ANALYTICS_PATH", "analytics.db")
+REBUILD_SECONDS = float(st.secrets.get("ANALYTICS_REBUILD_SECONDS", 86400))
+
+_BOOKING_UPSERT = (
+    "INSERT INTO bookings VALUES (?, ?, ?, ?)"
+    " ON CONFLICT(day, timeslot, status) DO UPDATE SET n = n + excluded.n"
+)
+_SLOT_UPSERT = (
+    "INSERT INTO open_slots VALUES (?, ?, ?)"
+    " ON CONFLICT(day, timeslot) DO UPDATE SET n = n + excluded.n"
+)
+
+# Sheets whose changes from outside this process mean a rebuild
+WATCHED_SHEETS = ("Appointment", "Schedule")
+
+_rebuild_lock = threading.Lock()
+_stale = False  # an update failed in this process; rebuild before the next read
+_seen = {}      # sheet name -> sheet_cache.outside_changes() when last checked
+
+
+def _connect():
+    conn = sqlite3.connect(ANALYTICS_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS bookings ("
+        " day TEXT, timeslot TEXT, status TEXT, n INTEGER NOT NULL,"
+        " PRIMARY KEY (day, timeslot, status))"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS open_slots ("
+        " day TEXT, timeslot TEXT, n INTEGER NOT NULL,"
+        " PRIMARY KEY (day, timeslot))"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+    return conn
+
+
+def _meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(conn, key, value):
+    conn.execute("INSERT INTO meta VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+
+def _update(bookings=(), slots=()):
+    # bookings: [((date, timeslot, status), change)]; slots: [((date, timeslot), change)].
+    # A failure never fails the write that reported it; the tables are rebuilt instead.
+    global _stale
+    try:
+        conn = _connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Lets a rebuild that was reading the sheets meanwhile know it may have missed this
+            _set_meta(conn, "changes", (_meta(conn, "changes") or 0) + 1)
+            conn.executemany(_BOOKING_UPSERT, [(*key, change) for key, change in bookings])
+            conn.executemany(_SLOT_UPSERT, [(*key, change) for key, change in slots])
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        _stale = True
+        print(f"Analytics update failed ({e}); the aggregates will be rebuilt")
+
+
+def booking_key(record):
+    return (
+        str(record.get("appointmentDate", "")),
+        str(record.get("appointmentTime", "")),
+        str(record.get("appointmentStatus", "")),
+    )
+
+
+def record_booking(date, time, status):
+    # A new appointment also takes the open slot it was booked into
+    _update(bookings=[((str(date), str(time), str(status)), 1)], slots=[((str(date), str(time)), -1)])
+
+
+def record_changes(changes):
+    # changes = [(booking_key before, booking_key after)] for updated appointments
+    moves = [move for before, after in changes if before != after for move in ((before, -1), (after, 1))]
+    if moves:
+        _update(bookings=moves)
+
+
+def record_slots(slots, change):
+    # Slots added to (change=1) or removed from (change=-1) the schedule
+    if slots:
+        _update(slots=[((str(date), str(time)), change) for date, time in slots])
+
+
+def rebuild():
+    # Recount everything from the sheets and their archives in one vectorized pass
+    import tables  # tables reads through google_sheets, which reports its writes here
+    from google_sheets import load_sheets
+
+    conn = _connect()
+    try:
+        changes = _meta(conn, "changes") or 0
+        load_sheets(["Appointment", "Schedule"])
+        appointments = pd.concat([tables.appointments_frame(), tables.archived_appointments_frame()], ignore_index=True)
+        schedule = pd.concat([tables.schedule_frame(), tables.archived_schedule_frame()], ignore_index=True)
+        booked = appointments.groupby(["appointmentDate", "appointmentTime", "appointmentStatus"], observed=True).size()
+        open_slots = schedule.groupby(["availableDate", "availableTimeslot"], observed=True).size()
+
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM bookings")
+        conn.execute("DELETE FROM open_slots")
+        conn.executemany(_BOOKING_UPSERT, [(*map(str, key), int(n)) for key, n in booked.items()])
+        conn.executemany(_SLOT_UPSERT, [(*map(str, key), int(n)) for key, n in open_slots.items()])
+        # A write reported while the sheets were being read may be missing: build again next time
+        current = (_meta(conn, "changes") or 0) == changes
+        _set_meta(conn, "built_at", time.time() if current else 0)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def invalidate():
+    # Rebuild before the next read, after rows were written without being reported here
+    conn = _connect()
+    try:
+        _set_meta(conn, "built_at", 0)
+    finally:
+        conn.close()
+
+
+def _ensure_current():
+    global _stale
+    with _rebuild_lock:
+        conn = _connect()
+        try:
+            built_at = _meta(conn, "built_at")
+        finally:
+            conn.close()
+        changed = any(sheet_cache.outside_changes(name) != _seen.get(name, 0) for name in WATCHED_SHEETS)
+        if _stale or changed or not built_at or time.time() - built_at > REBUILD_SECONDS:
+            _stale = False
+            rebuild()
+        # Taken after the rebuild, whose own reload may have found more
+        _seen.update({name: sheet_cache.outside_changes(name) for name in WATCHED_SHEETS})
+
+
+def last_built():
+    # When the tables were last rebuilt from the sheets, or None
+    conn = _connect()
+    try:
+        built_at = _meta(conn, "built_at")
+    finally:
+        conn.close()
+    return datetime.fromtimestamp(built_at) if built_at else None
+
+
+def _with_rates(frame):
+    # Rates are NaN where there is nothing to divide by. Utilization counts a
+    # slot as used when it holds an appointment that wasn't cancelled.
+    frame["active"] = frame["bookings"] - frame["cancelled"]
+    capacity = (frame["active"] + frame["open_slots"]).where(lambda n: n > 0)
+    bookings = frame["bookings"].where(lambda n: n > 0)
+    frame["utilization"] = frame["active"] / capacity
+    frame["cancellation_rate"] = frame["cancelled"] / bookings
+    frame["completion_rate"] = frame["completed"] / bookings
+    return frame
+
+
+def percent(rate):
+    return "–" if pd.isna(rate) else f"{rate:.0%}"
+
+
+def summary(date_from=None, date_to=None):
+    # {"daily", "weekly", "timeslots", "totals"} for appointment dates in the
+    # range (YYYY-MM-DD strings, both ends included), read from the aggregates only
+    _ensure_current()
+    params = (str(date_from or ""), str(date_to or "\uffff"))
+    conn = _connect()
+    try:
+        booked = pd.read_sql_query(
+            "SELECT day,"
+            " SUM(n) AS bookings,"
+            " SUM(CASE WHEN status = 'Cancelled' THEN n ELSE 0 END) AS cancelled,"
+            " SUM(CASE WHEN status = 'Completed' THEN n ELSE 0 END) AS completed"
+            " FROM bookings WHERE day BETWEEN ? AND ? GROUP BY day",
+            conn, params=params,
+        )
+        open_slots = pd.read_sql_query(
+            "SELECT day, SUM(n) AS open_slots FROM open_slots WHERE day BETWEEN ? AND ? GROUP BY day",
+            conn, params=params,
+        )
+        timeslots = pd.read_sql_query(
+            "SELECT timeslot, SUM(n) AS bookings FROM bookings"
+            " WHERE status != 'Cancelled' AND day BETWEEN ? AND ?"
+            " GROUP BY timeslot HAVING SUM(n) > 0 ORDER BY bookings DESC, timeslot",
+            conn, params=params,
+        )
+    finally:
+        conn.close()
+
+    daily = booked.merge(open_slots, on="day", how="outer").fillna(0)
+    daily["day"] = pd.to_datetime(daily["day"], format="%Y-%m-%d", errors="coerce")
+    daily = daily.dropna(subset=["day"]).set_index("day").sort_index()
+    counts = ["bookings", "cancelled", "completed", "open_slots"]
+    daily[counts] = daily[counts].clip(lower=0).astype(int)
+
+    weekly = daily[counts].groupby(daily.index.to_period("W-SUN").start_time).sum()
+    weekly.index.name = "week"
+    totals = _with_rates(daily[counts].sum().to_frame().T).iloc[0].to_dict()
+    return {"daily": _with_rates(daily), "weekly": _with_rates(weekly), "timeslots": timeslots, "totals": totals}
@@ -1,16 +1,32 @@
 import streamlit as st
 from auth import register_user, login_user, check_email_exists, check_password_complexity, get_customer_id
 from google_sheets import (
-    save_customer, upload_to_drive, save_appointment,
-    get_appointments, get_pharmacist_schedule,
-    update_schedule, update_appointment_status,
-    get_all_customers, save_report, get_all_reports,
-    restore_schedule_slot, remove_schedule_slot
+    save_customer, save_appointment,
+    add_schedule_slots, update_appointment_status, update_appointments, update_appointments_status,
+    save_report, restore_schedule_slot, remove_schedule_slot, load_sheets
 )
+from id_sequence import next_id
+from request_governor import QuotaExceededError
+from revisions import WriteConflictError
+from instrumentation import start_rerun, set_page, mark, finish_rerun, render_panel
+from availability import TIMESLOTS, available_dates, available_times
+from schedule_templates import WEEKDAYS, DEFAULT_WEEKDAYS, HOLIDAYS, parse_dates, expand
+from tables import (
+    ACTIVE_STATUSES, PAST_STATUSES, appointments_frame, archived_appointments_frame, schedule_frame,
+    id_mask, id_options, with_customers, rows
+)
+from report_index import search as search_reports
+import archive
+import analytics
+from referral_store import store as store_referral, path_for as referral_path_for, load as load_referral
+from st_aggrid import AgGrid, GridOptionsBuilder, DataReturnMode
+from datetime import date, timedelta
+import html
 import os
 import pandas as pd
 
 st.set_page_config(page_title="Farmasi Pantai Hillpark", layout="wide")
+start_rerun()
 
 # Load CSS
 with open("css/style.css") as f:
@@ -28,11 +44,47 @@ if 'logged_in' not in st.session_state:
 menu = ["Login", "Register"]
 if st.session_state.logged_in:
     if st.session_state.user_username in ["pharma01"]:  
-        menu = ["Manage Appointments", "Add Slot Availability","Available Slots", "Add Report", "Logout"]
+        menu = ["Manage Appointments", "Add Slot Availability","Available Slots", "Add Report", "Clinic Analytics", "Logout"]
     else:
         menu = ["Book Appointment", "My Appointments", "Logout"]
 
+STATUS_CHOICES = ["Pending Confirmation", "Confirmed", "Cancelled", "Completed"]
+
+# Write failures whose message already asks the user to try again
+TRY_AGAIN_ERRORS = (QuotaExceededError, WriteConflictError)
+
+# Manage Appointments grid: sort options (frame columns) and the columns shown
+MANAGE_SORT_COLUMNS = {
+    "Date": ["date", "slot"],
+    "Appointment ID": ["appointmentID"],
+    "Customer ID": ["customerID"],
+    "Status": ["appointmentStatus"],
+}
+MANAGE_GRID_COLUMNS = [
+    "appointmentID", "customerID", "customerName", "customerEmail", "customerNumber",
+    "appointmentDate", "appointmentTime", "appointmentStatus", "appointmentReferralLetter",
+]
+
+REPORTS_PER_PAGE = 10
+
+# Worksheets each page reads; they are loaded together before the page runs
+PAGE_SHEETS = {
+    "Login": ["Customer", "Pharmacist"],
+    "Register": ["Customer", "Pharmacist"],
+    "Book Appointment": ["Schedule", "Appointment"],
+    "My Appointments": ["Appointment", "Schedule"],
+    "Manage Appointments": ["Appointment", "Customer"],
+    "Add Slot Availability": ["Schedule"],
+    "Available Slots": ["Schedule"],
+    "Add Report": ["Report"],
+    # Refreshing these lets the analytics notice other replicas' writes
+    "Clinic Analytics": ["Appointment", "Schedule"],
+}
+
 choice = st.sidebar.selectbox("Menu", menu)
+set_page(choice)
+mark("load")
+load_sheets(PAGE_SHEETS.get(choice, []))
 
 # --------------------------------------------
 # Register
@@ -49,11 +101,15 @@ if choice == "Register":
             st.error("Please fill in all required fields.")
         elif not check_password_complexity(password):
             st.error("Password must be at least 8 characters and contain a special character.")
-        elif check_email_exists(email):
-            st.error("Email already exists. Please use a different email or login.")
         else:
-            customer_id = save_customer([username, password, full_name, email, phone, ""])
-            st.success(f"Registration successful! Your customer ID is {customer_id}. Please log in.")
+            try:
+                if check_email_exists(email):
+                    st.error("Email already exists. Please use a different email or login.")
+                else:
+                    customer_id = save_customer([username, password, full_name, email, phone, ""])
+                    st.success(f"Registration successful! Your customer ID is {customer_id}. Please log in.")
+            except TRY_AGAIN_ERRORS as e:
+                st.error(f"⏳ {e}")
 
 # --------------------------------------------
 # Login
@@ -63,8 +119,15 @@ if choice == "Login":
     password = st.text_input("Password", type="password")
 
     if st.button("Login"):
-        email = login_user(username, password)
-        if email:
+        try:
+            role, _, email = login_user(username, password)
+        except QuotaExceededError as e:
+            st.error(f"⏳ {e}")
+            st.stop()
+        except Exception as e:
+            st.error(f"⚠️ Couldn't check your login right now ({e}). Please try again.")
+            st.stop()
+        if role:
             st.session_state.logged_in = True
             st.session_state.user_username = username
             st.session_state.user_email = email
@@ -80,53 +143,58 @@ if choice == "Login":
 # Book Appointment
 elif choice == "Book Appointment":
     st.subheader("Book an Appointment")
-    available_schedule = get_pharmacist_schedule()
-    if not available_schedule:
+    open_dates = available_dates()
+    mark("render")
+    if not open_dates:
         st.warning("No available slots. Please try again later.")
     else:
-        available_dates = sorted(set(slot["availableDate"] for slot in available_schedule))
-        selected_date = st.selectbox("Select Date", available_dates)
-        available_times = [slot["availableTimeslot"] for slot in available_schedule if slot["availableDate"] == selected_date]
-        selected_time = st.selectbox("Select Time Slot", available_times)
+        selected_date = st.selectbox("Select Date", open_dates)
+        selected_time = st.selectbox("Select Time Slot", available_times(selected_date))
         uploaded_file = st.file_uploader("Upload Referral Letter")
 
         if st.button("Book Appointment"):
             if not uploaded_file:
                 st.error("Please upload a referral letter.")
             else:
-                if not os.path.exists("uploads"):
-                    os.makedirs("uploads")
-
-                # Save the uploaded file locally
-                file_path = f"uploads/{uploaded_file.name}"
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
+                # The letter is kept under its content hash, so its path is known before it is saved
+                file_path = referral_path_for(uploaded_file)
 
                 # Save appointment with referral path
-                save_appointment([
-                    st.session_state.customer_id,
-                    selected_date,
-                    selected_time,
-                    "Pending Confirmation"
-                ], referral_path=file_path)
-
-                st.success(f"Appointment booked on {selected_date} at {selected_time}.")
+                try:
+                    appointment_id = save_appointment([
+                        st.session_state.customer_id,
+                        selected_date,
+                        selected_time,
+                        "Pending Confirmation"
+                    ], referral_path=file_path)
+                except TRY_AGAIN_ERRORS as e:
+                    st.error(f"⏳ {e}")
+                    st.stop()
+
+                if appointment_id is None:
+                    st.error("Sorry, that slot was just taken. Please choose another time.")
+                else:
+                    # Only a booked appointment keeps its letter; the Drive copy is made in the background
+                    store_referral(uploaded_file)
+                    st.success(f"Appointment booked on {selected_date} at {selected_time}.")
 # --------------------------------------------
 # My Appointments
 elif choice == "My Appointments":
     st.subheader("📋 My Appointments")
 
-    appointments = get_appointments()
-    my_appointments = [
-        appt for appt in appointments
-        if str(appt.get('customerID')) == str(st.session_state.customer_id)
-    ]
+    appointments = appointments_frame()
+    my_appointments = appointments[id_mask(appointments, "customerID", st.session_state.customer_id)]
+    if st.checkbox("Include archived appointments"):
+        archived = archived_appointments_frame()
+        archived = archived[id_mask(archived, "customerID", st.session_state.customer_id)]
+        my_appointments = pd.concat([my_appointments, archived], ignore_index=True)
+    mark("render")
 
-    if not my_appointments:
+    if my_appointments.empty:
         st.info("No appointments found.")
     else:
-        active_appts = [appt for appt in my_appointments if appt['appointmentStatus'] in ["Pending Confirmation", "Confirmed", "Rescheduled"]]
-        past_appts = [appt for appt in my_appointments if appt['appointmentStatus'] in ["Cancelled", "Completed"]]
+        active_appts = rows(my_appointments[my_appointments["appointmentStatus"].isin(ACTIVE_STATUSES)])
+        past_appts = rows(my_appointments[my_appointments["appointmentStatus"].isin(PAST_STATUSES)])
 
         # --------------------
         # Section 1: Active
@@ -141,36 +209,36 @@ elif choice == "My Appointments":
             if cols[3].button("Reschedule", key=f"reschedule_{idx}"):
                 with st.form(f"reschedule_form_{idx}"):
                     st.subheader(f"Reschedule Slot for {appt['appointmentDate']} {appt['appointmentTime']}")
-                    schedule = get_pharmacist_schedule()
-                    booked = [(a['appointmentDate'], a['appointmentTime']) for a in get_appointments()]
-                    available_slots = [
-                        s for s in schedule if (s['availableDate'], s['availableTimeslot']) not in booked
-                    ]
-
-                    dates = sorted(list(set([s['availableDate'] for s in available_slots])))
-                    new_date = st.selectbox("New Date", dates)
-                    new_times = [s['availableTimeslot'] for s in available_slots if s['availableDate'] == new_date]
-                    new_time = st.selectbox("New Time", new_times)
+                    new_date = st.selectbox("New Date", available_dates())
+                    new_time = st.selectbox("New Time", available_times(new_date))
 
                     submitted = st.form_submit_button("Confirm Reschedule")
                     if submitted:
-                        update_appointment_status(
-                            appointment_id=appt["appointmentID"],
-                            new_status="Pending Confirmation",
-                            new_date=new_date,
-                            new_time=new_time
-                        )
-                        st.success("Rescheduled successfully!")
-                        st.rerun()
+                        try:
+                            update_appointment_status(
+                                appointment_id=appt["appointmentID"],
+                                new_status="Pending Confirmation",
+                                new_date=new_date,
+                                new_time=new_time
+                            )
+                        except TRY_AGAIN_ERRORS as e:
+                            st.error(f"⏳ {e}")
+                        else:
+                            st.success("Rescheduled successfully!")
+                            st.rerun()
 
             # CANCEL BUTTON
             if cols[4].button("❌ Cancel", key=f"cancel_{idx}"):
-                update_appointment_status(
-                    appointment_id=appt["appointmentID"],
-                    new_status="Cancelled"
-                )
-                st.success("❌ Appointment cancelled.")
-                st.rerun()
+                try:
+                    update_appointment_status(
+                        appointment_id=appt["appointmentID"],
+                        new_status="Cancelled"
+                    )
+                except TRY_AGAIN_ERRORS as e:
+                    st.error(f"⏳ {e}")
+                else:
+                    st.success("❌ Appointment cancelled.")
+                    st.rerun()
 
         # --------------------
         # Section 2: Past Appointments
@@ -194,74 +262,148 @@ elif choice == "My Appointments":
 elif choice == "Manage Appointments":
     st.subheader("🗂️ Manage Appointments")
 
-    appointments = get_appointments()
-    customers = {str(c["customerID"]): c for c in get_all_customers()}
-
-    if not appointments:
+    appointments = appointments_frame()
+    # Archived rows can't be written back, so with them shown the grid is read-only
+    read_only = st.toggle("Include archived appointments (read-only)")
+    if read_only:
+        appointments = pd.concat([appointments, archived_appointments_frame()], ignore_index=True)
+    mark("render")
+
+    # 🗄️ Archive: finished appointments and past slots move to monthly archive sheets
+    with st.expander("Archive old records"):
+        st.write(
+            f"Moves Cancelled and Completed appointments older than {archive.ARCHIVE_AFTER_DAYS} days, "
+            "and slots for past dates, to monthly archive sheets."
+        )
+        if st.button("Archive now"):
+            try:
+                moved = archive.run()
+                st.success(f"✅ Archived {moved['Appointment']} appointments and {moved['Schedule']} slots.")
+            except TRY_AGAIN_ERRORS as e:
+                st.error(f"⏳ {e}")
+
+    if appointments.empty:
         st.info("No appointments found.")
     else:
         # 🔍 Filter options
-        customer_ids = sorted(set(str(a["customerID"]) for a in appointments))
+        customer_ids = id_options(appointments, "customerID")
         statuses = ["All", "Pending Confirmation", "Confirmed", "Cancelled", "Completed"]
 
         selected_customer = st.selectbox("🔎 Filter by Customer ID", ["All"] + customer_ids)
         selected_status = st.selectbox("📌 Filter by Status", statuses)
 
-        # Apply filters
-        filtered_appointments = appointments
+        sort_cols = st.columns([2, 1, 1])
+        sort_by = sort_cols[0].selectbox("↕️ Sort by", list(MANAGE_SORT_COLUMNS))
+        descending = sort_cols[1].toggle("Descending")
+        page_size = sort_cols[2].selectbox("Rows per page", [25, 50, 100])
+
+        # Apply filters and sorting to the whole table; only one page is sent to the grid
+        mask = pd.Series(True, index=appointments.index)
         if selected_customer != "All":
-            filtered_appointments = [a for a in filtered_appointments if str(a["customerID"]) == selected_customer]
+            mask &= id_mask(appointments, "customerID", selected_customer)
         if selected_status != "All":
-            filtered_appointments = [a for a in filtered_appointments if a["appointmentStatus"] == selected_status]
-
-        st.markdown(f"### Showing {len(filtered_appointments)} appointments")
-
-        for idx, appt in enumerate(filtered_appointments):
-            cust = customers.get(str(appt["customerID"]), {})
-            full_name = cust.get("customerName", "Unknown")
-            email = cust.get("customerEmail", "N/A")
-            phone = cust.get("customerNumber", "N/A")
-            referral_path = appt.get("appointmentReferralLetter", "")
-
-            st.markdown(f"""
-                <div style="border: 1px solid #ccc; padding: 0.1px; border-radius: 6px; margin-bottom: 10px; background-color: #f9f9f9;">
-            """, unsafe_allow_html=True)
-
-            cols = st.columns([1, 1, 2, 2, 1.5, 1.5, 2, 2])
-            cols[0].write(f"🆔 {appt['appointmentID']}")
-            cols[1].write(f"🧾 CID: {appt['customerID']}")
-            cols[2].write(f"👤 {full_name}")
-            cols[3].write(f"📧 {email}\n\n📱 {phone}")
-            cols[4].write(f"📅 {appt['appointmentDate']}")
-            cols[5].write(f"🕒 {appt['appointmentTime']}")
-
-            # 📄 Referral Letter
-            if referral_path and os.path.exists(referral_path):
-                with open(referral_path, "rb") as f:
-                    cols[6].download_button(
-                        label="📄 Download",
-                        data=f,
+            mask &= appointments["appointmentStatus"] == selected_status
+        filtered = appointments[mask].sort_values(MANAGE_SORT_COLUMNS[sort_by], ascending=not descending, kind="stable")
+
+        total = len(filtered)
+        page_count = max(1, -(-total // page_size))
+        page_number = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+        start = (page_number - 1) * page_size
+        end = min(start + page_size, total)
+        st.markdown(f"### Showing {start + 1 if total else 0}–{end} of {total} appointments")
+
+        grid_frame = pd.DataFrame(
+            rows(with_customers(filtered.iloc[start:end]), MANAGE_GRID_COLUMNS),
+            columns=MANAGE_GRID_COLUMNS,
+        ).fillna("")
+        grid_frame.insert(len(MANAGE_GRID_COLUMNS) - 1, "referral", grid_frame["appointmentReferralLetter"].map(lambda p: "📄" if p else ""))
+
+        builder = GridOptionsBuilder.from_dataframe(grid_frame)
+        builder.configure_default_column(sortable=True, filter=True, resizable=True)
+        builder.configure_column("appointmentID", header_name="🆔 ID")
+        builder.configure_column("customerID", header_name="🧾 CID")
+        builder.configure_column("customerName", header_name="👤 Name")
+        builder.configure_column("customerEmail", header_name="📧 Email")
+        builder.configure_column("customerNumber", header_name="📱 Phone")
+        builder.configure_column("appointmentDate", header_name="📅 Date")
+        builder.configure_column("appointmentTime", header_name="🕒 Time")
+        if read_only:
+            builder.configure_column("appointmentStatus", header_name="📌 Status")
+        else:
+            builder.configure_column(
+                "appointmentStatus", header_name="📌 Status (double-click to edit)", editable=True,
+                cellEditor="agSelectCellEditor", cellEditorParams={"values": STATUS_CHOICES}
+            )
+            builder.configure_selection("multiple", use_checkbox=True, header_checkbox=True)
+        builder.configure_column("referral", header_name="📄 Referral")
+        builder.configure_column("appointmentReferralLetter", hide=True)
+
+        grid = AgGrid(
+            grid_frame,
+            gridOptions=builder.build(),
+            data_return_mode=DataReturnMode.AS_INPUT,
+            update_on=["cellValueChanged", "selectionChanged"],
+            key=f"appointments_grid_{read_only}_{selected_customer}_{selected_status}_{sort_by}_{descending}_{page_size}_{page_number}",
+        )
+        if read_only:
+            st.caption("Turn off archived appointments to edit statuses or download referral letters.")
+        else:
+            # ✅ Inline edits: every changed status on the page goes out in one API call
+            original = dict(zip(grid_frame["appointmentID"].astype(str), grid_frame["appointmentStatus"]))
+            edited = grid.data
+            changes = {
+                appointment_id: {"appointmentStatus": status}
+                for appointment_id, status in zip(edited["appointmentID"].astype(str), edited["appointmentStatus"])
+                if original.get(appointment_id) != status
+            }
+            if changes and st.button(f"💾 Save {len(changes)} status change(s)"):
+                try:
+                    updated = update_appointments(changes)
+                except TRY_AGAIN_ERRORS as e:
+                    st.error(f"⏳ {e}")
+                else:
+                    st.success(f"✅ {updated} appointments updated.")
+                    st.rerun()
+
+            selected = grid.selected_data
+            selected_ids = [] if selected is None else selected["appointmentID"].tolist()
+
+            # ✅ Bulk update: every selected appointment goes out in one API call
+            with st.expander("Bulk status update"):
+                st.write(f"{len(selected_ids)} appointments selected in the grid.")
+                bulk_status = st.selectbox("Set status to", ["Confirmed", "Completed", "Cancelled", "Pending Confirmation"], key="bulk_status")
+                if st.button("Apply to selected"):
+                    if not selected_ids:
+                        st.warning("Select at least one appointment.")
+                    else:
+                        try:
+                            updated = update_appointments_status(selected_ids, bulk_status)
+                        except TRY_AGAIN_ERRORS as e:
+                            st.error(f"⏳ {e}")
+                        else:
+                            st.success(f"✅ {updated} appointments updated.")
+                            st.rerun()
+
+            # 📄 Referral Letter: only the selected row's file is opened
+            if len(selected_ids) == 1:
+                referral_path = selected.iloc[0]["appointmentReferralLetter"]
+                try:
+                    referral = load_referral(referral_path)
+                except QuotaExceededError as e:
+                    st.error(f"⏳ {e}")
+                    referral = None
+                if referral is not None:
+                    st.download_button(
+                        label=f"📄 Download referral for appointment {selected_ids[0]}",
+                        data=referral,
                         file_name=os.path.basename(referral_path),
                         mime="application/octet-stream",
-                        key=f"download_{idx}"
+                        key="download_referral"
                     )
+                else:
+                    st.caption("No referral letter for this appointment.")
             else:
-                cols[6].write("—")
-
-            # ✅ Update status
-            new_status = cols[7].selectbox(
-                "appointmentStatus",
-                ["Pending Confirmation", "Confirmed", "Cancelled", "Completed"],
-                index=["Pending Confirmation", "Confirmed", "Cancelled", "Completed"].index(appt["appointmentStatus"]),
-                key=f"status_{idx}"
-            )
-
-            if st.button("Update", key=f"update_{idx}"):
-                update_appointment_status(appt["appointmentID"], new_status)
-                st.success(f"✅ Appointment {appt['appointmentID']} updated.")
-                st.rerun()
-
-            st.markdown("</div>", unsafe_allow_html=True)
+                st.caption("Select a single row to download its referral letter.")
 
 
 # --------------------------------------------
@@ -269,34 +411,71 @@ elif choice == "Manage Appointments":
 elif choice == "Add Slot Availability":
     st.subheader("➕ Add New Slot")
     slot_date = st.date_input("Available Date")
-    slot_time = st.selectbox("Available Time", ["8:00AM-9:00AM","9:00AM-10:00AM", "10:00AM-11:00AM", "11:00AM-12:00PM","2:00PM-3:00PM", "3:00PM-4:00PM", "4:00PM-5:00PM"])
-    schedule = get_pharmacist_schedule()
+    slot_time = st.selectbox("Available Time", TIMESLOTS)
     if st.button("Add Slot"):
-        if any(s["availableDate"] == str(slot_date) and s["availableTimeslot"] == slot_time for s in schedule):
-            st.warning("Slot already exists.")
+        # Same check as a template: a slot held by an active appointment isn't reopened
+        try:
+            added = add_schedule_slots([(str(slot_date), slot_time)])
+        except TRY_AGAIN_ERRORS as e:
+            st.error(f"⏳ {e}")
         else:
-            update_schedule(str(slot_date), slot_time)
-            st.success("Slot added!")
-            st.rerun()
+            if not added:
+                st.warning("Slot already exists.")
+            else:
+                st.success("Slot added!")
+                st.rerun()
+
+    # --------------------
+    # Weekly template: a whole date range in one write
+    st.markdown("---")
+    st.subheader("📆 Publish a Weekly Template")
+    with st.form("slot_template"):
+        date_cols = st.columns(2)
+        template_start = date_cols[0].date_input("From", date.today())
+        template_end = date_cols[1].date_input("To", date.today() + timedelta(days=27))
+        template_days = st.multiselect("Weekdays", WEEKDAYS, default=DEFAULT_WEEKDAYS)
+        template_slots = st.multiselect("Timeslots", TIMESLOTS, default=TIMESLOTS)
+        holiday_text = st.text_area("Holidays to skip (YYYY-MM-DD, one per line)", "\n".join(HOLIDAYS))
+        publish_clicked = st.form_submit_button("Publish Slots")
+
+    if publish_clicked:
+        try:
+            holidays = parse_dates(holiday_text)
+        except ValueError:
+            st.error("Holidays must be dates in YYYY-MM-DD format.")
+        else:
+            if template_end < template_start:
+                st.error("The end date is before the start date.")
+            elif not template_days or not template_slots:
+                st.error("Choose at least one weekday and one timeslot.")
+            else:
+                planned = expand(template_start, template_end, template_days, template_slots, holidays)
+                try:
+                    added = add_schedule_slots(planned)
+                    st.success(f"✅ {len(added)} slots published; {len(planned) - len(added)} already existed or were booked.")
+                except TRY_AGAIN_ERRORS as e:
+                    st.error(f"⏳ {e}")
 
 elif choice == "Available Slots":
     st.subheader("📌 Available Slots")
 
-    schedule = get_pharmacist_schedule()
-    if not schedule:
+    df_slots = schedule_frame()
+    mark("render")
+    if df_slots.empty:
         st.info("No slots available.")
     else:
-        df_slots = pd.DataFrame(schedule)
-
-        for idx, row in df_slots.iterrows():
+        for idx, row in enumerate(rows(df_slots, ["availableDate", "availableTimeslot"])):
             cols = st.columns([3, 3, 1])
             cols[0].write(f"📅 Date: **{row['availableDate']}**")
             cols[1].write(f"🕒 Time: **{row['availableTimeslot']}**")
             if cols[2].button("❌ Delete", key=f"delete_slot_{idx}"):
-                from google_sheets import remove_schedule_slot
-                remove_schedule_slot(row['availableDate'], row['availableTimeslot'])
-                st.success(f"Slot on {row['availableDate']} at {row['availableTimeslot']} deleted.")
-                st.rerun()
+                try:
+                    remove_schedule_slot(row['availableDate'], row['availableTimeslot'])
+                except TRY_AGAIN_ERRORS as e:
+                    st.error(f"⏳ {e}")
+                else:
+                    st.success(f"Slot on {row['availableDate']} at {row['availableTimeslot']} deleted.")
+                    st.rerun()
 
 
 
@@ -316,65 +495,129 @@ elif choice == "Add Report":
         if not all([customer_id, appt_id, content]):
             st.error("Please complete all fields.")
         else:
-            # Generate numeric reportID with no prefix
-            reports = get_all_reports()
-            existing_ids = [
-            int(r.get("reportID", 0)) for r in reports
-            if str(r.get("reportID", "")).isdigit()
-        ]
-            next_id = max(existing_ids, default=0) + 1
-            report_id = next_id
-
-            # Save to sheet
-            save_report([report_id, customer_id, appt_id, str(report_date), content])
-            st.success("✅ Report saved.")
+            try:
+                # Numeric reportID with no prefix, taken from the Counters sheet
+                report_id = next_id("reportID")
+
+                # Save to sheet
+                save_report([report_id, customer_id, appt_id, str(report_date), content])
+            except TRY_AGAIN_ERRORS as e:
+                st.error(f"⏳ {e}")
+            else:
+                st.success("✅ Report saved.")
 
     # --- Interactive Report Viewer ---
     st.markdown("### 📂 View Submitted Reports")
 
-    reports = get_all_reports()
+    filter_cols = st.columns(3)
+    search_text = filter_cols[0].text_input("🔎 Search report content")
+    selected_cust_id = filter_cols[1].text_input("Filter by Customer ID")
+    selected_appt_id = filter_cols[2].text_input("Filter by Appointment ID")
+    date_range = st.date_input("Filter by report date range", value=())
+    date_from = date_to = None
+    if len(date_range) == 2:
+        date_from, date_to = str(date_range[0]), str(date_range[1])
+    elif len(date_range) == 1:
+        date_from = date_to = str(date_range[0])
+
+    filters = dict(text=search_text, customer_id=selected_cust_id, appointment_id=selected_appt_id,
+                   date_from=date_from, date_to=date_to)
+    total, _ = search_reports(**filters, limit=0)
+    mark("render")
+
+    if total == 0:
+        if any(filters.values()):
+            st.info("No matching reports found.")
+        else:
+            st.warning("⚠️ No valid reports found or data is not structured correctly.")
+    else:
+        # Only one page of reports is rendered
+        page_count = -(-total // REPORTS_PER_PAGE)
+        page_number = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1, key="report_page")
+        _, page_reports = search_reports(**filters, offset=(page_number - 1) * REPORTS_PER_PAGE, limit=REPORTS_PER_PAGE)
+        st.caption(f"{total} reports, newest first · page {page_number} of {page_count}")
+
+        for rep in page_reports:
+            st.markdown(f"""
+                <div style="
+                    border: 1px solid rgba(120, 120, 120, 0.3);
+                    padding: 10px;
+                    margin-bottom: 10px;
+                    border-radius: 8px;
+                    background-color: rgba(255, 255, 255, 0.05);
+                    backdrop-filter: blur(2px);
+                    color: inherit;
+                ">
+                    <strong>📋 Report ID:</strong> {html.escape(str(rep.get('reportID', '')))}<br>
+                    <strong>👤 Customer ID:</strong> {html.escape(str(rep.get('customerID', '')))}<br>
+                    <strong>📎 Appointment ID:</strong> {html.escape(str(rep.get('appointmentID', '')))}<br>
+                    <strong>📅 Date:</strong> {html.escape(str(rep.get('reportDate', '')))}<br>
+                    <strong>📝 Content:</strong><br>
+                    <div style="margin-left: 15px;">{html.escape(str(rep.get('reportContent', '')))}</div>
+                </div>
+            """, unsafe_allow_html=True)
 
-    # Defensive check for empty or malformed data
-    if not reports or not isinstance(reports, list) or not isinstance(reports[0], dict):
-        st.warning("⚠️ No valid reports found or data is not structured correctly.")
+# --------------------------------------------
+# Clinic Analytics: reads only the precomputed aggregates
+elif choice == "Clinic Analytics":
+    st.subheader("📊 Clinic Analytics")
+
+    range_cols = st.columns(2)
+    analytics_from = range_cols[0].date_input("From", date.today() - timedelta(days=30))
+    analytics_to = range_cols[1].date_input("To", date.today() + timedelta(days=30))
+    try:
+        stats = analytics.summary(str(analytics_from), str(analytics_to))
+    except QuotaExceededError as e:
+        st.error(f"⏳ {e}")
+        st.stop()
+    mark("render")
+
+    totals = stats["totals"]
+    metric_cols = st.columns(4)
+    metric_cols[0].metric("Bookings", int(totals["bookings"]))
+    metric_cols[1].metric("Slot utilization", analytics.percent(totals["utilization"]))
+    metric_cols[2].metric("Cancellation rate", analytics.percent(totals["cancellation_rate"]))
+    metric_cols[3].metric("Completion rate", analytics.percent(totals["completion_rate"]))
+
+    daily = stats["daily"]
+    if daily.empty:
+        st.info("No appointments or slots in this period.")
     else:
-        # Extract dropdown options safely
-        customer_ids = sorted(set(str(r.get("customerID", "")) for r in reports if "customerID" in r))
-        appointment_ids = sorted(set(str(r.get("appointmentID", "")) for r in reports if "appointmentID" in r))
-
-        selected_cust_id = st.selectbox("Filter by Customer ID", ["All"] + customer_ids)
-        selected_appt_id = st.selectbox("Filter by Appointment ID", ["All"] + appointment_ids)
-
-        # Apply filters
-        filtered_reports = reports
-        if selected_cust_id != "All":
-            filtered_reports = [r for r in filtered_reports if str(r.get("customerID", "")) == selected_cust_id]
-        if selected_appt_id != "All":
-            filtered_reports = [r for r in filtered_reports if str(r.get("appointmentID", "")) == selected_appt_id]
-
-        # Display
-        if not filtered_reports:
-            st.info("No matching reports found.")
+        st.markdown("### 📅 Bookings per day")
+        st.bar_chart(daily[["active", "cancelled"]])
+
+        st.markdown("### 📈 Slot utilization per day")
+        st.line_chart(daily["utilization"])
+
+        st.markdown("### 🗓️ Weekly summary")
+        weekly = stats["weekly"]
+        st.dataframe(pd.DataFrame({
+            "Week of": weekly.index.strftime("%Y-%m-%d"),
+            "Bookings": weekly["bookings"],
+            "Open slots": weekly["open_slots"],
+            "Utilization": weekly["utilization"].map(analytics.percent),
+            "Cancelled": weekly["cancellation_rate"].map(analytics.percent),
+            "Completed": weekly["completion_rate"].map(analytics.percent),
+        }), hide_index=True)
+
+        st.markdown("### 🕒 Busiest timeslots")
+        timeslots = stats["timeslots"]
+        if timeslots.empty:
+            st.caption("No active bookings in this period.")
         else:
-            for rep in filtered_reports:
-                st.markdown(f"""
-                    <div style="
-                        border: 1px solid rgba(120, 120, 120, 0.3);
-                        padding: 10px;
-                        margin-bottom: 10px;
-                        border-radius: 8px;
-                        background-color: rgba(255, 255, 255, 0.05);
-                        backdrop-filter: blur(2px);
-                        color: inherit;
-                    ">
-                        <strong>📋 Report ID:</strong> {rep.get('reportID', '')}<br>
-                        <strong>👤 Customer ID:</strong> {rep.get('customerID', '')}<br>
-                        <strong>📎 Appointment ID:</strong> {rep.get('appointmentID', '')}<br>
-                        <strong>📅 Date:</strong> {rep.get('reportDate', '')}<br>
-                        <strong>📝 Content:</strong><br>
-                        <div style="margin-left: 15px;">{rep.get('reportContent', '')}</div>
-                    </div>
-                """, unsafe_allow_html=True)
+            st.bar_chart(timeslots.set_index("timeslot")["bookings"])
+
+    built = analytics.last_built()
+    st.caption(
+        f"Counts rebuilt from the sheets {built:%Y-%m-%d %H:%M}; bookings, status changes and slot changes "
+        "made in the app since then are already included." if built else "Counts have not been built yet."
+    )
+    if st.button("Rebuild now"):
+        try:
+            analytics.rebuild()
+            st.rerun()
+        except QuotaExceededError as e:
+            st.error(f"⏳ {e}")
 
 # --------------------------------------------
 # Logout
@@ -382,3 +625,9 @@ elif choice == "Logout":
     for key in list(st.session_state.keys()):
         del st.session_state[key]
     st.rerun()
+
+# --------------------------------------------
+# API cost panel (pharmacist only)
+finish_rerun()
+if st.session_state.get("user_username") in ["pharma01"]:
+    render_panel()
@@ -0,0 +1,85 @@
+# archive.py
+# Keeps Appointment and Schedule small. Cancelled and Completed appointments
+# older than ARCHIVE_AFTER_DAYS, and slots for dates that have passed, are
+# moved to per-month worksheets such as "Appointment Archive 2024-05" and
+# "Schedule Archive 2024-05". Pages read those only when asked to show history.
+# Run it from Manage Appointments or on a schedule:
+#
+#   python archive.py             # move everything that is due
+#   python archive.py --dry-run   # only count it
+import argparse
+from datetime import date, datetime, timedelta
+import streamlit as st
+
+from google_sheets import archive_rows, get_appointments, get_pharmacist_schedule
+import sheet_cache
+
+ARCHIVE_AFTER_DAYS = int(st.secrets.get("ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_BATCH_ROWS = int(st.secrets.get("ARCHIVE_BATCH_ROWS", 500))
+FINISHED_STATUSES = {"Cancelled", "Completed"}
+
+
+def archive_name(sheet_name, day):
+    return f"{sheet_name} Archive {day:%Y-%m}"
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(str(value).strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def _finished_appointments(cutoff):
+    def archive_for(record):
+        if str(record.get("appointmentStatus")) not in FINISHED_STATUSES:
+            return None
+        day = _parse_date(record.get("appointmentDate"))
+        return archive_name("Appointment", day) if day and day < cutoff else None
+    return archive_for
+
+
+def _past_slots(today):
+    def archive_for(record):
+        day = _parse_date(record.get("availableDate"))
+        return archive_name("Schedule", day) if day and day < today else None
+    return archive_for
+
+
+def _jobs(today):
+    return {
+        "Appointment": (get_appointments, _finished_appointments(today - timedelta(days=ARCHIVE_AFTER_DAYS))),
+        "Schedule": (get_pharmacist_schedule, _past_slots(today)),
+    }
+
+
+def run(today=None, dry_run=False):
+    # {sheet name: rows moved (or due, with dry_run)}
+    today = today or date.today()
+    moved = {}
+    for sheet_name, (read, archive_for) in _jobs(today).items():
+        # Row numbers must match the sheet exactly, so start from a fresh copy
+        sheet_cache.invalidate(sheet_name)
+        if dry_run:
+            moved[sheet_name] = sum(1 for record in read() if archive_for(record))
+            continue
+        total = 0
+        while True:
+            count = archive_rows(sheet_name, archive_for, limit=ARCHIVE_BATCH_ROWS)
+            total += count
+            if count < ARCHIVE_BATCH_ROWS:
+                break
+        moved[sheet_name] = total
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move finished appointments and past slots to monthly archive sheets")
+    parser.add_argument("--dry-run", action="store_true", help="count the rows that are due without moving them")
+    args = parser.parse_args()
+    for sheet_name, count in run(dry_run=args.dry_run).items():
+        print(f"{sheet_name}: {count} rows {'due' if args.dry_run else 'archived'}")
+
+
+if __name__ == "__main__":
+    main()
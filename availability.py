@@ -0,0 +1,72 @@
+# availability.py
+# Open slots for the booking and reschedule forms. The date -> timeslots map
+# and the set of booked (date, timeslot) pairs are built once per version of
+# the Schedule and Appointment data, so each form lookup is a dict access.
+from datetime import datetime
+
+from google_sheets import _normalize_slot
+import sheet_cache
+from storage import pluggable
+
+# The clinic's bookable hours, in display order
+TIMESLOTS = [
+    "8:00AM-9:00AM", "9:00AM-10:00AM", "10:00AM-11:00AM", "11:00AM-12:00PM",
+    "2:00PM-3:00PM", "3:00PM-4:00PM", "4:00PM-5:00PM",
+]
+
+_state = {"versions": None, "by_date": {}, "dates": []}
+
+
+def timeslot_sort_key(timeslot):
+    # "8:00AM-9:00AM" sorts by its start time; anything unparsable goes last
+    start = str(timeslot).split("-")[0].strip().upper()
+    try:
+        parsed = datetime.strptime(start, "%I:%M%p")
+    except ValueError:
+        return 1, 0, str(timeslot)
+    return 0, parsed.hour * 60 + parsed.minute, str(timeslot)
+
+
+def _build(schedule, appointments):
+    # A cancelled appointment frees its slot, so it may be offered again
+    booked = frozenset(
+        _normalize_slot(a["appointmentDate"], a["appointmentTime"])
+        for a in appointments
+        if str(a["appointmentStatus"]) != "Cancelled"
+    )
+    by_date = {}
+    for slot in schedule:
+        date, time = str(slot["availableDate"]), str(slot["availableTimeslot"])
+        if _normalize_slot(date, time) not in booked:
+            by_date.setdefault(date, set()).add(time)
+    return {
+        "by_date": {date: sorted(times, key=timeslot_sort_key) for date, times in by_date.items()},
+        "dates": sorted(by_date),
+    }
+
+
+def _current():
+    global _state
+    sheet_cache.prefetch(["Schedule", "Appointment"])
+    schedule, schedule_version = sheet_cache.snapshot("Schedule")
+    appointments, appointment_version = sheet_cache.snapshot("Appointment")
+    versions = (schedule_version, appointment_version)
+
+    state = _state
+    if None not in versions and state["versions"] == versions:
+        return state
+
+    state = {"versions": versions, **_build(schedule, appointments)}
+    if None not in versions:
+        _state = state
+    return state
+
+
+@pluggable
+def available_dates():
+    return _current()["dates"]
+
+
+@pluggable
+def available_times(date):
+    return _current()["by_date"].get(str(date), [])
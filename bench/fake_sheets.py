@@ -0,0 +1,309 @@
+# bench/fake_sheets.py
+# In-memory stand-in for a gspread Spreadsheet and its Worksheets, covering the
+# calls this app makes. Every call is counted and can be slowed down to mimic
+# the network: a fixed delay per request plus a delay per cell transferred.
+import re
+import threading
+import time
+from collections import Counter
+
+import gspread
+from gspread.utils import numericise_all
+
+_A1 = re.compile(r"^([A-Za-z]*)(\d*)$")
+
+
+def _cell_str(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _parse_a1(part):
+    col, row = _A1.match(part).groups()
+    col_number = 0
+    for ch in col.upper():
+        col_number = col_number * 26 + (ord(ch) - 64)
+    return col_number or None, int(row) if row else None
+
+
+def _trim_row(row):
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+def _trim(grid):
+    grid = [_trim_row(r) for r in grid]
+    while grid and not grid[-1]:
+        grid.pop()
+    return grid
+
+
+class _ErrorResponse:
+    # Just enough of a requests.Response for gspread.exceptions.APIError
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.text = message
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": self.text, "status": "INVALID_ARGUMENT"}}
+
+
+def _user_entered(cell):
+    value = cell.get("userEnteredValue", {})
+    return value.get("stringValue", value.get("numberValue", ""))
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, sheet_id, rows=None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self._rows = [list(r) for r in (rows or [])]
+
+    def _call(self, operation, cells=0):
+        self.spreadsheet._call(operation, self.title, cells)
+
+    def _grid(self):
+        return [[_cell_str(v) for v in r] for r in self._rows]
+
+    def _range(self, range_name):
+        if range_name and "!" in range_name:
+            range_name = range_name.split("!", 1)[1]
+        if not range_name:
+            return _trim(self._grid())
+        first, _, last = range_name.partition(":")
+        c1, r1 = _parse_a1(first)
+        c2, r2 = _parse_a1(last or first)
+        r1, r2 = r1 or 1, r2 or len(self._rows)
+        c1 = c1 or 1
+        out = []
+        for r in range(r1, r2 + 1):
+            row = self._rows[r - 1] if r - 1 < len(self._rows) else []
+            out.append([_cell_str(v) for v in row[c1 - 1:c2]])
+        return _trim(out)
+
+    def _set(self, row, col, value):
+        while len(self._rows) < row:
+            self._rows.append([])
+        cells = self._rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = value
+
+    def _write(self, range_name, values):
+        if "!" in range_name:
+            range_name = range_name.split("!", 1)[1]
+        col, row = _parse_a1(range_name.split(":")[0])
+        for i, cells in enumerate(values):
+            for j, value in enumerate(cells):
+                self._set((row or 1) + i, (col or 1) + j, value)
+
+    def _append(self, rows):
+        start = len(self._rows) + 1
+        self._rows.extend(list(r) for r in rows)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:Z{len(self._rows)}", "updatedRows": len(rows)}}
+
+    @property
+    def row_count(self):
+        return len(self._rows)
+
+    def get_all_records(self, **kwargs):
+        grid = self._grid()
+        self._call("get_all_records", sum(len(r) for r in grid))
+        if not grid:
+            return []
+        keys = grid[0]
+        return [dict(zip(keys, numericise_all((r + [""] * len(keys))[:len(keys)]))) for r in grid[1:]]
+
+    def get_all_values(self, **kwargs):
+        values = _trim(self._grid())
+        self._call("get_all_values", sum(len(r) for r in values))
+        return values
+
+    def get(self, range_name=None, **kwargs):
+        values = self._range(range_name)
+        self._call("get", sum(len(r) for r in values))
+        return values
+
+    get_values = get
+
+    def batch_get(self, ranges, **kwargs):
+        values = [self._range(r) for r in ranges]
+        self._call("batch_get", sum(len(r) for v in values for r in v))
+        return values
+
+    def row_values(self, row, **kwargs):
+        values = _trim_row(self._grid()[row - 1]) if row - 1 < len(self._rows) else []
+        self._call("row_values", len(values))
+        return values
+
+    def col_values(self, col, **kwargs):
+        values = _trim_row([_cell_str(r[col - 1]) if col - 1 < len(r) else "" for r in self._rows])
+        self._call("col_values", len(values))
+        return values
+
+    def append_row(self, values, **kwargs):
+        self._call("append_row", len(values))
+        return self._append([values])
+
+    def append_rows(self, values, **kwargs):
+        self._call("append_rows", sum(len(r) for r in values))
+        return self._append(values)
+
+    def delete_rows(self, start_index, end_index=None):
+        self._call("delete_rows")
+        del self._rows[start_index - 1:(end_index or start_index)]
+
+    def update_cell(self, row, col, value):
+        self._call("update_cell", 1)
+        self._set(row, col, value)
+
+    def update(self, values=None, range_name=None, **kwargs):
+        if isinstance(values, str):
+            values, range_name = range_name, values
+        self._call("update", sum(len(r) for r in values))
+        self._write(range_name or "A1", values)
+
+    def batch_update(self, data, **kwargs):
+        self._call("batch_update", sum(len(r) for d in data for r in d["values"]))
+        for d in data:
+            self._write(d["range"], d["values"])
+
+    def batch_clear(self, ranges):
+        self._call("batch_clear")
+        for range_name in ranges:
+            first = range_name.split("!")[-1].split(":")[0]
+            _, row = _parse_a1(first)
+            del self._rows[(row or 1) - 1:]
+
+    def clear(self):
+        self._call("clear")
+        self._rows = []
+
+
+class FakeSpreadsheet:
+    def __init__(self, sheets=None, latency=0.0, cell_latency=0.0):
+        self.id = "offline-spreadsheet"
+        self.title = "Offline"
+        self.latency = latency            # seconds per request
+        self.cell_latency = cell_latency  # extra seconds per cell sent or received
+        self.calls = Counter()
+        self.cells = 0
+        self._lock = threading.RLock()
+        self._sheets = {}
+        self._named_ranges = {}  # namedRangeId -> named range
+        self._next_id = 1
+        for title, rows in (sheets or {}).items():
+            self._add(title, rows)
+
+    def _add(self, title, rows=None):
+        ws = FakeWorksheet(self, title, self._next_id, rows)
+        self._next_id += 1
+        self._sheets[title] = ws
+        return ws
+
+    def _call(self, operation, sheet=None, cells=0):
+        with self._lock:
+            self.calls[operation] += 1
+            self.cells += cells
+        delay = self.latency + self.cell_latency * cells
+        if delay:
+            time.sleep(delay)
+
+    def _by_id(self, sheet_id):
+        for ws in self._sheets.values():
+            if ws.id == sheet_id:
+                return ws
+        raise KeyError(sheet_id)
+
+    def _sheet_and_range(self, a1):
+        title, _, range_name = a1.partition("!")
+        return self._sheets[title.strip("'")], range_name or None
+
+    def worksheet(self, title):
+        self._call("worksheet")
+        if title not in self._sheets:
+            raise gspread.WorksheetNotFound(title)
+        return self._sheets[title]
+
+    def worksheets(self, **kwargs):
+        self._call("worksheets")
+        return list(self._sheets.values())
+
+    def add_worksheet(self, title, rows=100, cols=26, **kwargs):
+        self._call("add_worksheet")
+        return self._add(title)
+
+    def del_worksheet(self, worksheet):
+        self._call("del_worksheet")
+        self._sheets.pop(worksheet.title, None)
+
+    def values_batch_get(self, ranges, params=None):
+        value_ranges = []
+        for a1 in ranges:
+            ws, range_name = self._sheet_and_range(a1)
+            value_ranges.append({"range": a1, "values": ws._range(range_name)})
+        self._call("values_batch_get", cells=sum(len(r) for v in value_ranges for r in v["values"]))
+        return {"spreadsheetId": self.id, "valueRanges": value_ranges}
+
+    def values_batch_update(self, body=None):
+        self._call("values_batch_update", cells=sum(len(r) for d in body["data"] for r in d["values"]))
+        for d in body["data"]:
+            ws, range_name = self._sheet_and_range(d["range"])
+            ws._write(range_name or "A1", d["values"])
+        return {"spreadsheetId": self.id}
+
+    def _check_named_ranges(self, requests):
+        # batchUpdate is all-or-nothing: reject the whole body before applying any of it
+        ids = set(self._named_ranges)
+        for i, request in enumerate(requests):
+            if "deleteNamedRange" in request:
+                named_range_id = request["deleteNamedRange"]["namedRangeId"]
+                if named_range_id not in ids:
+                    raise gspread.exceptions.APIError(_ErrorResponse(
+                        400, f"Invalid requests[{i}].deleteNamedRange: No named range with id: {named_range_id}"))
+                ids.discard(named_range_id)
+            elif "addNamedRange" in request:
+                named_range_id = request["addNamedRange"]["namedRange"]["namedRangeId"]
+                if named_range_id in ids:
+                    raise gspread.exceptions.APIError(_ErrorResponse(
+                        400, f"Invalid requests[{i}].addNamedRange: A named range with id {named_range_id} already exists."))
+                ids.add(named_range_id)
+
+    def batch_update(self, body):
+        self._call("batch_update")
+        with self._lock:
+            self._check_named_ranges(body["requests"])
+            return self._apply(body["requests"])
+
+    def _apply(self, requests):
+        replies = []
+        for request in requests:
+            if "addNamedRange" in request:
+                named_range = request["addNamedRange"]["namedRange"]
+                self._named_ranges[named_range["namedRangeId"]] = named_range
+            elif "deleteNamedRange" in request:
+                del self._named_ranges[request["deleteNamedRange"]["namedRangeId"]]
+            elif "appendCells" in request:
+                append = request["appendCells"]
+                rows = [[_user_entered(c) for c in row.get("values", [])] for row in append["rows"]]
+                self._by_id(append["sheetId"])._append(rows)
+            elif "deleteDimension" in request:
+                span = request["deleteDimension"]["range"]
+                del self._by_id(span["sheetId"])._rows[span["startIndex"]:span["endIndex"]]
+            elif "updateCells" in request:
+                update = request["updateCells"]
+                start = update["start"]
+                ws = self._by_id(start["sheetId"])
+                for i, row in enumerate(update["rows"]):
+                    for j, cell in enumerate(row.get("values", [])):
+                        ws._set(start.get("rowIndex", 0) + i + 1, start.get("columnIndex", 0) + j + 1, _user_entered(cell))
+            else:
+                raise NotImplementedError(f"Offline spreadsheet does not support {list(request)}")
+            replies.append({})
+        return {"spreadsheetId": self.id, "replies": replies}
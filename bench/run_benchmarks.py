@@ -0,0 +1,226 @@
+# bench/run_benchmarks.py
+# Offline benchmarks for the main user flows, run against the in-memory
+# spreadsheet in fake_sheets.py. Each sheet size runs in its own process so
+# caches start empty. For every flow we report API calls, cells transferred,
+# wall time (cold and warm cache) and peak Python memory.
+#
+#   python bench/run_benchmarks.py                           # 1k, 10k, 100k rows
+#   python bench/run_benchmarks.py --sizes 1000 --latency 0.2
+#   python bench/run_benchmarks.py --save baseline           # bench/results/baseline.json
+#   python bench/run_benchmarks.py --compare bench/results/baseline.json
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+TIMESLOTS = ["8:00AM-9:00AM", "9:00AM-10:00AM", "10:00AM-11:00AM", "11:00AM-12:00PM",
+             "2:00PM-3:00PM", "3:00PM-4:00PM", "4:00PM-5:00PM"]
+STATUSES = ["Pending Confirmation", "Confirmed", "Cancelled", "Completed"]
+
+
+def _date(day):
+    return f"{2020 + day // 336}-{1 + day // 28 % 12:02d}-{1 + day % 28:02d}"
+
+
+def seed_sheets(rows):
+    customers = max(1, rows // 4)
+    return {
+        "Customer": [["customerID", "customerUsername", "customerPassword", "customerName", "customerEmail", "customerNumber", "customerReferral"]]
+        + [[i, f"user{i}", "secret!123", f"Customer {i}", f"user{i}@example.com", f"01{i:08d}", ""] for i in range(1, customers + 1)],
+        "Pharmacist": [["pharmacistID", "pharmacistUsername", "pharmacistPassword", "pharmacistName", "pharmacistEmail"],
+                       [1, "pharma01", "secret!123", "Pharmacist", "pharma01@example.com"]],
+        "Appointment": [["appointmentID", "customerID", "appointmentDate", "appointmentTime", "appointmentStatus", "appointmentReferralLetter"]]
+        + [[i, 1 + i % customers, _date(i // 7), TIMESLOTS[i % 7], STATUSES[i % 4], ""] for i in range(1, rows + 1)],
+        "Schedule": [["availableDate", "availableTimeslot"]]
+        + [[_date(rows // 7 + 1 + i // 7), TIMESLOTS[i % 7]] for i in range(rows)],
+        "Report": [["reportID", "customerID", "appointmentID", "reportDate", "reportContent"]]
+        + [[i, 1 + i % customers, i, _date(i // 7), f"Follow-up visit {i}: blood pressure normal, continue medication."] for i in range(1, rows + 1)],
+        "Counters": [["sequence", "nextValue"],
+                     ["customerID", customers + 1], ["appointmentID", rows + 1], ["reportID", rows + 1]],
+    }
+
+
+def flows(rows):
+    # name -> callable; imported lazily so the offline spreadsheet is attached first
+    import auth
+    import availability
+    import google_sheets
+    import sheet_cache
+    import tables
+
+    customers = max(1, rows // 4)
+    counter = iter(range(10 ** 9))
+
+    def login():
+        assert auth.login_user(f"user{customers}", "secret!123")[0] == "Customer"
+        auth.get_customer_id(f"user{customers}")
+
+    def register():
+        n = next(counter)
+        if not auth.check_email_exists(f"new{n}@example.com"):
+            google_sheets.save_customer([f"new{n}", "secret!123", "New Customer", f"new{n}@example.com", "0123456789", ""])
+
+    def book():
+        date = availability.available_dates()[0]
+        time_slot = availability.available_times(date)[0]
+        assert google_sheets.save_appointment([1, date, time_slot, "Pending Confirmation"]) is not None
+
+    def reschedule():
+        google_sheets.update_appointment_status(rows // 2, "Pending Confirmation", _date(rows), TIMESLOTS[0])
+
+    def bulk_confirm():
+        google_sheets.update_appointments_status(range(1, min(rows, 50) + 1), "Confirmed")
+
+    def manage_appointments():
+        appointments = tables.appointments_frame()
+        tables.with_customers(appointments[appointments["appointmentStatus"] == "Pending Confirmation"])
+
+    def expired_refresh():
+        # What a long-running session pays every CACHE_TTL: the warm run only
+        # downloads the tail of the sheet
+        entry = sheet_cache._entries.get("Appointment")
+        if entry is not None:
+            entry["loaded_at"] = float("-inf")
+        google_sheets.get_appointments()
+
+    def report_viewer():
+        reports = tables.reports_frame()
+        tables.rows(reports[tables.id_mask(reports, "customerID", "1")])
+
+    return {
+        "login": login,
+        "register": register,
+        "book_appointment": book,
+        "reschedule": reschedule,
+        "bulk_confirm_50": bulk_confirm,
+        "manage_appointments": manage_appointments,
+        "report_viewer": report_viewer,
+        "expired_refresh": expired_refresh,
+    }
+
+
+def _reset_caches():
+    import sheet_cache
+    for name in ("Customer", "Pharmacist", "Appointment", "Schedule", "Report"):
+        sheet_cache.invalidate(name)
+
+
+def _measure(fake, fn):
+    calls_before, cells_before = sum(fake.calls.values()), fake.cells
+    start = time.perf_counter()
+    fn()
+    return {
+        "ms": round((time.perf_counter() - start) * 1000, 2),
+        "api_calls": sum(fake.calls.values()) - calls_before,
+        "cells": fake.cells - cells_before,
+    }
+
+
+def run_worker(rows, latency, cell_latency):
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    from fake_sheets import FakeSpreadsheet
+    import sheets_client
+
+    fake = FakeSpreadsheet(seed_sheets(rows), latency=latency, cell_latency=cell_latency)
+    sheets_client.get_client().attach(fake)
+    sheets_client.get_client().refresh_worksheets()
+
+    results = {}
+    for name, fn in flows(rows).items():
+        _reset_caches()
+        cold = _measure(fake, fn)
+        warm = _measure(fake, fn)
+
+        _reset_caches()
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[name] = {
+            "cold_ms": cold["ms"],
+            "cold_api_calls": cold["api_calls"],
+            "cold_cells": cold["cells"],
+            "warm_ms": warm["ms"],
+            "warm_api_calls": warm["api_calls"],
+            "warm_cells": warm["cells"],
+            "peak_kb": round(peak / 1024, 1),
+        }
+    return results
+
+
+def run_all(sizes, latency, cell_latency):
+    results = {}
+    for rows in sizes:
+        print(f"Running {rows} rows...", file=sys.stderr)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", "--sizes", str(rows),
+             "--latency", str(latency), "--cell-latency", str(cell_latency)],
+            cwd=BENCH_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        results[str(rows)] = json.loads(output.strip().splitlines()[-1])
+    return {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "latency": latency,
+        "cell_latency": cell_latency,
+        "sizes": results,
+    }
+
+
+def _change(new, old):
+    if not old:
+        return ""
+    return f" ({(new - old) / old * 100:+.0f}%)"
+
+
+def print_report(report, baseline=None):
+    metrics = ("cold_api_calls", "warm_api_calls", "cold_ms", "warm_ms", "peak_kb")
+    for rows, flows_result in report["sizes"].items():
+        print(f"\n== {rows} rows ==")
+        print(f"{'flow':<22}" + "".join(f"{m:>24}" for m in metrics))
+        base = (baseline or {}).get("sizes", {}).get(rows, {})
+        for flow, values in flows_result.items():
+            old = base.get(flow, {})
+            cells = [f"{values[m]}{_change(values[m], old.get(m))}" for m in metrics]
+            print(f"{flow:<22}" + "".join(f"{c:>24}" for c in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks against an in-memory spreadsheet")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per API request")
+    parser.add_argument("--cell-latency", type=float, default=0.0, help="simulated seconds per cell transferred")
+    parser.add_argument("--save", help="store the results as bench/results/<name>.json")
+    parser.add_argument("--compare", help="baseline results file to compare against")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.sizes[0], args.latency, args.cell_latency)))
+        return
+
+    report = run_all(args.sizes, args.latency, args.cell_latency)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{args.save}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved to {path}")
+
+
+if __name__ == "__main__":
+    main()
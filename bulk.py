@@ -0,0 +1,227 @@
+# bulk.py
+# Bulk import and export for onboarding and migrations, instead of entering
+# customers one at a time on the Register page:
+#
+#   python bulk.py import Customer customers.csv
+#   python bulk.py import Schedule slots.jsonl
+#   python bulk.py import Appointment appointments.csv --dry-run
+#   python bulk.py export Customer Schedule Appointment --out exports --format jsonl
+#
+# Input is CSV with a header row, or JSON lines, keyed by the worksheet's
+# column names. IDs are assigned here and any ID column in the file is ignored;
+# appointments may name their customer by customerID, customerEmail or
+# customerUsername. The sheets are read once, and duplicates are checked
+# against that snapshot and the rows accepted so far. The file is streamed:
+# IDs are reserved one block per chunk and each chunk of IMPORT_CHUNK_ROWS
+# rows is a single append. Exports read EXPORT_PAGE_ROWS rows per request and
+# write them straight to the file.
+import argparse
+import csv
+import json
+import os
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+import streamlit as st
+
+from google_sheets import (
+    load_sheets, get_all_customers, get_appointments, get_pharmacist_schedule,
+    sheet_headers, import_rows, remove_schedule_slots, read_pages
+)
+from id_sequence import next_ids
+from tables import STATUSES
+import analytics
+
+IMPORT_CHUNK_ROWS = int(st.secrets.get("IMPORT_CHUNK_ROWS", 10000))
+EXPORT_PAGE_ROWS = int(st.secrets.get("EXPORT_PAGE_ROWS", 5000))
+
+
+def read_records(path):
+    # Dicts from a CSV or JSON-lines file, one at a time, with values stripped
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            records = csv.DictReader(f)
+        for record in records:
+            yield {str(k).strip(): "" if v is None else str(v).strip() for k, v in record.items() if k is not None}
+
+
+def _valid_date(value):
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
+
+
+def _slot(date, time):
+    return str(date).strip().lower(), str(time).strip().lower()
+
+
+def _active_slots(appointments):
+    return {
+        _slot(a.get("appointmentDate"), a.get("appointmentTime"))
+        for a in appointments
+        if str(a.get("appointmentStatus")) != "Cancelled"
+    }
+
+
+def _customers(records, counts):
+    existing = get_all_customers()
+    usernames = {str(c.get("customerUsername")).strip() for c in existing}
+    emails = {str(c.get("customerEmail")).strip().lower() for c in existing}
+    for record in records:
+        username, email = record.get("customerUsername", ""), record.get("customerEmail", "").lower()
+        # A blank password would let anyone log in with an empty one
+        if not all([username, email, record.get("customerPassword"), record.get("customerName")]):
+            counts["invalid"] += 1
+        elif username in usernames or email in emails:
+            counts["duplicate"] += 1
+        else:
+            usernames.add(username)
+            emails.add(email)
+            yield record
+
+
+def _slots(records, counts):
+    taken = {_slot(s.get("availableDate"), s.get("availableTimeslot")) for s in get_pharmacist_schedule()}
+    taken |= _active_slots(get_appointments())
+    for record in records:
+        date, time = record.get("availableDate", ""), record.get("availableTimeslot", "")
+        if not time or not _valid_date(date):
+            counts["invalid"] += 1
+        elif _slot(date, time) in taken:
+            counts["duplicate"] += 1
+        else:
+            taken.add(_slot(date, time))
+            yield record
+
+
+def _appointments(records, counts):
+    customers = get_all_customers()
+    ids = {str(c.get("customerID")) for c in customers}
+    by_email = {str(c.get("customerEmail")).strip().lower(): str(c.get("customerID")) for c in customers}
+    by_username = {str(c.get("customerUsername")).strip(): str(c.get("customerID")) for c in customers}
+    existing = get_appointments()
+    booked = {(str(a.get("customerID")),) + _slot(a.get("appointmentDate"), a.get("appointmentTime")) for a in existing}
+    held = _active_slots(existing)
+
+    for record in records:
+        customer_id = record.get("customerID", "")
+        if customer_id not in ids:
+            customer_id = by_email.get(record.get("customerEmail", "").lower()) or by_username.get(record.get("customerUsername", ""))
+        date, time = record.get("appointmentDate", ""), record.get("appointmentTime", "")
+        status = record.get("appointmentStatus") or "Pending Confirmation"
+        key = (customer_id,) + _slot(date, time)
+        if not customer_id:
+            counts["unknown customer"] += 1
+        elif not time or not _valid_date(date) or status not in STATUSES:
+            counts["invalid"] += 1
+        elif key in booked:
+            counts["duplicate"] += 1
+        elif status != "Cancelled" and _slot(date, time) in held:
+            counts["slot taken"] += 1
+        else:
+            booked.add(key)
+            if status != "Cancelled":
+                held.add(_slot(date, time))
+            yield {**record, "customerID": customer_id, "appointmentStatus": status}
+
+
+# worksheet -> (filter over the file's records, ID sequence or None)
+IMPORTERS = {
+    "Customer": (_customers, "customerID"),
+    "Schedule": (_slots, None),
+    "Appointment": (_appointments, "appointmentID"),
+}
+
+
+def import_file(sheet_name, path, chunk_rows=IMPORT_CHUNK_ROWS, dry_run=False):
+    # Counter of rows imported (or due, with dry_run) and rows skipped, by reason
+    accept, sequence = IMPORTERS[sheet_name]
+    # One batched read: every check below runs against this snapshot
+    load_sheets(["Customer", "Schedule", "Appointment"])
+    headers = sheet_headers(sheet_name)
+    counts = Counter()
+    booked_slots = []
+    accepted = accept(read_records(path), counts)
+
+    while True:
+        chunk = list(islice(accepted, chunk_rows))
+        if not chunk:
+            break
+        counts["imported"] += len(chunk)
+        if sheet_name == "Appointment":
+            booked_slots += [
+                (r["appointmentDate"], r["appointmentTime"]) for r in chunk if r["appointmentStatus"] != "Cancelled"
+            ]
+        if dry_run:
+            continue
+        if sequence:
+            for record, new_id in zip(chunk, next_ids(sequence, len(chunk))):
+                record[sequence] = new_id
+        import_rows(sheet_name, [[record.get(h, "") for h in headers] for record in chunk])
+
+    if not dry_run and counts["imported"]:
+        # Imported appointments take their open slots, as a booking would
+        if booked_slots:
+            remove_schedule_slots(booked_slots)
+        analytics.invalidate()
+    return counts
+
+
+def export_sheet(sheet_name, path, file_format="csv", page_rows=EXPORT_PAGE_ROWS):
+    # Writes the worksheet to `path` page by page; returns the number of data rows
+    count = 0
+    headers = None
+    partial_path = path + ".part"
+    with open(partial_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for page in read_pages(sheet_name, page_rows):
+            if headers is None:
+                headers, page = page[0], page[1:]
+                if file_format == "csv":
+                    writer.writerow(headers)
+            for row in page:
+                row = (list(row) + [""] * len(headers))[:len(headers)]
+                if file_format == "csv":
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(dict(zip(headers, row))) + "\n")
+            count += len(page)
+    os.replace(partial_path, path)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import and export of the clinic worksheets")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="append rows from a CSV or JSON-lines file")
+    importer.add_argument("sheet", choices=list(IMPORTERS))
+    importer.add_argument("path")
+    importer.add_argument("--chunk-rows", type=int, default=IMPORT_CHUNK_ROWS, help="rows per append request")
+    importer.add_argument("--dry-run", action="store_true", help="check and count the rows without writing them")
+
+    exporter = commands.add_parser("export", help="write worksheets to files, a page of rows per request")
+    exporter.add_argument("sheets", nargs="+")
+    exporter.add_argument("--out", default="exports", help="directory for the files (default: exports)")
+    exporter.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    exporter.add_argument("--page-rows", type=int, default=EXPORT_PAGE_ROWS, help="rows per read request")
+
+    args = parser.parse_args()
+    if args.command == "import":
+        counts = import_file(args.sheet, args.path, args.chunk_rows, args.dry_run)
+        imported = counts.pop("imported", 0)
+        skipped = ", ".join(f"{n} {reason}" for reason, n in sorted(counts.items())) or "none"
+        print(f"{args.sheet}: {imported} rows {'due' if args.dry_run else 'imported'}; skipped: {skipped}")
+    else:
+        os.makedirs(args.out, exist_ok=True)
+        for sheet_name in args.sheets:
+            path = os.path.join(args.out, f"{sheet_name}.{args.format}")
+            print(f"{sheet_name}: {export_sheet(sheet_name, path, args.format, args.page_rows)} rows -> {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,132 +1,436 @@
 import os
 import mimetypes
 import json
+import threading
+import gspread
 import streamlit as st
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 
-from sheets_client import spreadsheet, creds
+from sheets_client import get_client, worksheet as open_worksheet
+import request_governor as governor
+import sheet_cache
+import write_queue
+import analytics
+import revisions
+from id_sequence import next_id
+from storage import pluggable
 
 FOLDER_ID = st.secrets["FOLDER_ID"]
+DRIVE_CHUNK_SIZE = 4 * 1024 * 1024  # bytes per resumable upload / download request
 
-def generate_next_id(sheet_name, col_name):
-    worksheet = spreadsheet.worksheet(sheet_name)
-    records = worksheet.get_all_records()
+# Serializes check-then-write changes to Schedule within this process
+_booking_lock = threading.RLock()
 
-    if not records:
-        return 1
-
-    # Get the highest current ID
-    try:
-        last_id = int(records[-1][col_name])
-    except:
-        last_id = 0
-
-    return last_id + 1
+def append_sheet_rows(sheet_name, rows):
+    # Appends go through the write-behind queue when it is enabled for the sheet
+    if write_queue.enabled(sheet_name):
+        write_queue.enqueue(sheet_name, rows)
+    else:
+        planned = sheet_cache.version(sheet_name)
+        governor.write("append_rows", sheet_name, open_worksheet(sheet_name).append_rows, rows)
+        sheet_cache.append_rows(sheet_name, rows, planned)
 
+@pluggable
+def load_sheets(sheet_names):
+    # Warm the cache for every sheet a page reads, in a single round trip
+    sheet_cache.prefetch(sheet_names)
 
 def register_user(username, password, full_name, email, phone):
-    worksheet = spreadsheet.worksheet("Customer")
-    worksheet.append_row([username, password, full_name, email, phone])
+    append_sheet_rows("Customer", [[username, password, full_name, email, phone]])
 
+@pluggable
 def save_customer(data):
-    worksheet = spreadsheet.worksheet("Customer")
-    customer_id = generate_next_id("Customer", "customerID")
-    worksheet.append_row([customer_id] + data)  # data = [username, password, full_name, email, phone, ""]
+    customer_id = next_id("customerID")
+    row = [customer_id] + data  # data = [username, password, full_name, email, phone, ""]
+    append_sheet_rows("Customer", [row])
     return customer_id
 
 
+def _cell_data(value):
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+@pluggable
 def save_appointment(data, referral_path=None):
-    worksheet = spreadsheet.worksheet("Appointment")
-    appointment_id = generate_next_id("Appointment", "appointmentID")
+    # data = [customerID, date, time, status]. The appointment append and the
+    # removal of the booked slot go out as one versioned batchUpdate on
+    # Schedule, so two sessions or replicas can't book the same slot. A slot
+    # row that an active appointment already holds (left by a reschedule, or
+    # added again) isn't bookable either. Returns the new appointmentID, or
+    # None when the slot is no longer available.
     if referral_path is None:
         referral_path = ""
-    worksheet.append_row([appointment_id] + data + [referral_path])
-    remove_schedule_slot(data[1], data[2])  # Remove booked slot
+    key = _normalize_slot(data[1], data[2])
+    row = []
+
+    def plan(positions):
+        if key not in positions:
+            return []
+        if not row:
+            row.extend([next_id("appointmentID")] + data + [referral_path])
+        return [
+            {"appendCells": {
+                "sheetId": open_worksheet("Appointment").id,
+                "rows": [{"values": [_cell_data(v) for v in row]}],
+                "fields": "userEnteredValue",
+            }},
+        ] + _delete_row_requests("Schedule", [positions[key]])
 
+    with _booking_lock:
+        sheet_cache.prefetch(["Schedule", "Appointment"])
+        if key in _active_booking_keys():
+            return None
+        planned = {name: sheet_cache.version(name) for name in ("Appointment", "Schedule")}
+        positions = revisions.write_rows("Schedule", "book_slot", [key], _slot_key, SLOT_COLUMNS, plan)
+        if key not in positions:
+            return None
+        sheet_cache.append_rows("Appointment", [row], planned["Appointment"])
+        sheet_cache.delete_rows("Schedule", [positions[key]], planned["Schedule"])
+    analytics.record_booking(data[1], data[2], data[3])
+    return row[0]
+
+@pluggable
 def get_appointments():
-    return spreadsheet.worksheet("Appointment").get_all_records()
+    return sheet_cache.get_records("Appointment")
 
+@pluggable
 def update_schedule(date, time):
-    spreadsheet.worksheet("Schedule").append_row([date, time])
+    with _booking_lock:
+        planned = sheet_cache.version("Schedule")
+        governor.write("append_row", "Schedule", open_worksheet("Schedule").append_row, [date, time])
+        sheet_cache.append_rows("Schedule", [[date, time]], planned)
+    analytics.record_slots([(date, time)], 1)
+
+def _active_booking_keys():
+    # Slots held by an appointment that hasn't been cancelled
+    return {
+        _normalize_slot(a["appointmentDate"], a["appointmentTime"])
+        for a in sheet_cache.get_records("Appointment")
+        if str(a.get("appointmentStatus")) != "Cancelled"
+    }
+
+@pluggable
+def add_schedule_slots(slots):
+    # slots = [(date, timeslot), ...]. Slots that are already open or held by
+    # an active appointment are left out (booking removes the slot row, so
+    # the schedule alone would let a booked slot reopen); the rest go out in
+    # one append_rows call. Returns the rows added.
+    with _booking_lock:
+        sheet_cache.prefetch(["Schedule", "Appointment"])
+        taken = set(sheet_cache.row_index("Schedule", _slot_key)) | _active_booking_keys()
+        rows = []
+        for date, time in slots:
+            key = _normalize_slot(date, time)
+            if key not in taken:
+                taken.add(key)
+                rows.append([str(date), time])
+        if rows:
+            planned = sheet_cache.version("Schedule")
+            governor.write("append_rows", "Schedule", open_worksheet("Schedule").append_rows, rows)
+            sheet_cache.append_rows("Schedule", rows, planned)
+            analytics.record_slots(rows, 1)
+        return rows
 
+@pluggable
 def get_pharmacist_schedule():
-    return spreadsheet.worksheet("Schedule").get_all_records()
+    return sheet_cache.get_records("Schedule")
 
+def _normalize_slot(date, time):
+    return str(date).strip().lower(), str(time).strip().lower()
+
+def _slot_key(record):
+    return _normalize_slot(record["availableDate"], record["availableTimeslot"])
+
+SLOT_COLUMNS = ["availableDate", "availableTimeslot"]
+
+def find_schedule_slot(date, time):
+    # Sheet row number of an available (date, timeslot), or None
+    return sheet_cache.row_index("Schedule", _slot_key).get(_normalize_slot(date, time))
+
+@pluggable
+def slot_exists(date, time):
+    return find_schedule_slot(date, time) is not None
+
+@pluggable
 def remove_schedule_slot(date, time):
-    ws = spreadsheet.worksheet("Schedule")
-    records = ws.get_all_records()
-    date = str(date).strip().lower()
-    time = str(time).strip().lower()
-
-    for idx, record in enumerate(records, start=2):  # offset header
-        rec_date = str(record["availableDate"]).strip().lower()
-        rec_time = str(record["availableTimeslot"]).strip().lower()
-        if rec_date == date and rec_time == time:
-            ws.delete_rows(idx)
-            return
+    remove_schedule_slots([(date, time)])
 
+@pluggable
+def remove_schedule_slots(slots):
+    # Deletes the open rows for [(date, timeslot)] in one versioned
+    # batchUpdate and returns the slots that were found
+    slots = {_normalize_slot(date, time): (date, time) for date, time in slots}
+    with _booking_lock:
+        sheet_cache.prefetch(["Schedule"])
+        planned = sheet_cache.version("Schedule")
+        positions = revisions.write_rows(
+            "Schedule", "delete_rows", list(slots), _slot_key, SLOT_COLUMNS,
+            lambda positions: _delete_row_requests("Schedule", positions.values()),
+        )
+        if positions:
+            sheet_cache.delete_rows("Schedule", list(positions.values()), planned)
+    removed = [slots[key] for key in positions]
+    analytics.record_slots(removed, -1)
+    return removed
+
+@pluggable
 def restore_schedule_slot(date, time):
-    ws = spreadsheet.worksheet("Schedule")
-    records = ws.get_all_records()
-    for record in records:
-        if str(record["availableDate"]).strip().lower() == str(date).strip().lower() and \
-           str(record["availableTimeslot"]).strip().lower() == str(time).strip().lower():
+    with _booking_lock:
+        if slot_exists(date, time):
             return  # already exists
-    ws.append_row([date, time])
+        planned = sheet_cache.version("Schedule")
+        governor.write("append_row", "Schedule", open_worksheet("Schedule").append_row, [date, time])
+        sheet_cache.append_rows("Schedule", [[date, time]], planned)
+        analytics.record_slots([(date, time)], 1)
+
+def _appointment_key(record):
+    return str(record["appointmentID"])
 
+APPOINTMENT_KEY_COLUMNS = ["appointmentID"]
+
+# sheet name -> (row key, columns it is read from), for versioned row writes
+ROW_KEYS = {
+    "Appointment": (_appointment_key, APPOINTMENT_KEY_COLUMNS),
+    "Schedule": (_slot_key, SLOT_COLUMNS),
+}
+
+@pluggable
+def update_appointments(changes):
+    # changes = {appointmentID: {column name: new value}}; every field of every
+    # appointment goes out in a single versioned batchUpdate, addressed to the
+    # rows that hold those IDs when it is sent
+    columns = sheet_cache.column_map("Appointment")
+    changes = {str(appointment_id): {col: value for col, value in fields.items() if value}
+               for appointment_id, fields in changes.items()}
+    changes = {appointment_id: fields for appointment_id, fields in changes.items() if fields}
+    records, _ = sheet_cache.snapshot("Appointment")
+    index = sheet_cache.row_index("Appointment", _appointment_key)
+    old = {}  # the rows as cached, for the analytics counts
+    for appointment_id in changes:
+        row_number = index.get(appointment_id)
+        if row_number is not None and row_number - 2 < len(records):
+            old[appointment_id] = records[row_number - 2]
+    sheet_id = open_worksheet("Appointment").id
+
+    def plan(positions):
+        return [
+            {"updateCells": {
+                "start": {"sheetId": sheet_id, "rowIndex": row_number - 1, "columnIndex": columns[col] - 1},
+                "rows": [{"values": [_cell_data(value)]}],
+                "fields": "userEnteredValue",
+            }}
+            for appointment_id, row_number in positions.items()
+            for col, value in changes[appointment_id].items()
+        ]
+
+    planned = sheet_cache.version("Appointment")
+    positions = revisions.write_rows(
+        "Appointment", "batch_update", list(changes), _appointment_key, APPOINTMENT_KEY_COLUMNS, plan
+    )
+    if positions:
+        sheet_cache.update_rows(
+            "Appointment",
+            {row_number: changes[appointment_id] for appointment_id, row_number in positions.items()},
+            planned,
+        )
+        analytics.record_changes([
+            (analytics.booking_key(old[appointment_id]), analytics.booking_key({**old[appointment_id], **changes[appointment_id]}))
+            for appointment_id in positions if appointment_id in old
+        ])
+    return len(positions)
+
+@pluggable
 def update_appointment_status(appointment_id, new_status=None, new_date=None, new_time=None):
-    sheet = spreadsheet.worksheet("Appointment")
-    headers = sheet.row_values(1)
-    records = sheet.get_all_records()
+    update_appointments({
+        appointment_id: {
+            "appointmentStatus": new_status,
+            "appointmentDate": new_date,
+            "appointmentTime": new_time,
+        }
+    })
+
+@pluggable
+def update_appointments_status(appointment_ids, new_status):
+    # Bulk variant for the pharmacist view: one write for any number of rows
+    return update_appointments({appointment_id: {"appointmentStatus": new_status} for appointment_id in appointment_ids})
+
+def _archive_sheet(sheet_name, headers):
+    # Archive worksheets are created on first use, with the live sheet's header
+    try:
+        return open_worksheet(sheet_name)
+    except gspread.WorksheetNotFound:
+        client = get_client()
+        ws = governor.write("add_worksheet", sheet_name, client.spreadsheet.add_worksheet,
+                            title=sheet_name, rows=100, cols=len(headers))
+        governor.write("append_row", sheet_name, ws.append_row, headers)
+        client.refresh_worksheets()
+        return ws
 
-    for idx, row in enumerate(records):
-        if str(row["appointmentID"]) == str(appointment_id):
-            row_number = idx + 2  # header is row 1
+def _row_spans(row_numbers):
+    # Runs of consecutive rows as [first, last], bottom of the sheet first so
+    # each deletion leaves the row numbers of the next one unchanged
+    spans = []
+    for row_number in sorted(row_numbers, reverse=True):
+        if spans and spans[-1][0] == row_number + 1:
+            spans[-1][0] = row_number
+        else:
+            spans.append([row_number, row_number])
+    return spans
 
-            if new_status:
-                col = headers.index("appointmentStatus") + 1
-                sheet.update_cell(row_number, col, new_status)
+def _delete_row_requests(sheet_name, row_numbers):
+    sheet_id = open_worksheet(sheet_name).id
+    return [
+        {"deleteDimension": {"range": {
+            "sheetId": sheet_id,
+            "dimension": "ROWS",
+            "startIndex": first - 1,
+            "endIndex": last,
+        }}}
+        for first, last in _row_spans(row_numbers)
+    ]
 
-            if new_date:
-                col = headers.index("appointmentDate") + 1
-                sheet.update_cell(row_number, col, new_date)
+@pluggable
+def archive_rows(sheet_name, archive_for, limit=None):
+    # Moves every row for which archive_for(record) names a worksheet to the
+    # end of that worksheet. The appends and the deletions here go out in one
+    # batchUpdate, so a row is never in both places or neither. Returns the
+    # number of rows moved, at most `limit`.
+    key_fn, key_columns = ROW_KEYS[sheet_name]
+    with _booking_lock:
+        records, _ = sheet_cache.snapshot(sheet_name)
+        headers = list(sheet_cache.column_map(sheet_name))
+        due = {}  # row key -> (archive sheet, row values)
+        for record in records:
+            if limit is not None and len(due) >= limit:
+                break
+            target = archive_for(record)
+            if target:
+                due.setdefault(key_fn(record), (target, [record.get(h, "") for h in headers]))
+        if not due:
+            return 0
 
-            if new_time:
-                col = headers.index("appointmentTime") + 1
-                sheet.update_cell(row_number, col, new_time)
+        moves = {}
 
-            break
+        def plan(positions):
+            moves.clear()
+            for key in positions:
+                target, row = due[key]
+                moves.setdefault(target, []).append(row)
+            if not moves:
+                return []
+            return [
+                {"appendCells": {
+                    "sheetId": _archive_sheet(target, headers).id,
+                    "rows": [{"values": [_cell_data(v) for v in row]} for row in rows],
+                    "fields": "userEnteredValue",
+                }}
+                for target, rows in moves.items()
+            ] + _delete_row_requests(sheet_name, positions.values())
+
+        planned = {name: sheet_cache.version(name) for name in {sheet_name} | {target for target, _ in due.values()}}
+        positions = revisions.write_rows(sheet_name, "archive_rows", list(due), key_fn, key_columns, plan)
+        sheet_cache.delete_rows(sheet_name, list(positions.values()), planned[sheet_name])
+        for target, rows in moves.items():
+            sheet_cache.append_rows(target, rows, planned[target])
+        return len(positions)
+
+@pluggable
+def archived_records(sheet_name):
+    # Rows archived from `sheet_name`, oldest month first. Only pages that
+    # explicitly ask for history call this.
+    names = sorted(name for name in get_client().refresh_worksheets() if name.startswith(f"{sheet_name} Archive "))
+    sheet_cache.prefetch(names)
+    return [record for name in names for record in sheet_cache.get_records(name)]
 
 def upload_to_drive(file_path):
-    drive_service = build("drive", "v3", credentials=creds)
+    # Resumable upload, one request per DRIVE_CHUNK_SIZE piece, so a dropped
+    # connection only resends the current piece
+    client = get_client()
     file_metadata = {
         "name": os.path.basename(file_path),
         "parents": [FOLDER_ID]
     }
     mimetype, _ = mimetypes.guess_type(file_path)
-    media = MediaFileUpload(file_path, mimetype=mimetype)
-    uploaded_file = drive_service.files().create(
+    media = MediaFileUpload(file_path, mimetype=mimetype or "application/octet-stream",
+                            chunksize=DRIVE_CHUNK_SIZE, resumable=True)
+    request = client.drive.files().create(
         body=file_metadata,
         media_body=media,
         fields="id"
-    ).execute()
+    )
+    uploaded_file = None
+    while uploaded_file is None:
+        _, uploaded_file = governor.write("drive_upload", "Drive", request.next_chunk, http=client.drive_http(), num_retries=3)
     return uploaded_file.get("id")
 
+def find_in_drive(file_name):
+    # ID of the file called `file_name` in the Drive folder, or None
+    client = get_client()
+    escaped = file_name.replace("\\", "\\\\").replace("'", "\\'")
+    request = client.drive.files().list(
+        q=f"name = '{escaped}' and '{FOLDER_ID}' in parents and trashed = false",
+        fields="files(id)",
+        pageSize=1
+    )
+    files = governor.read("drive_find", "Drive", request.execute, http=client.drive_http()).get("files", [])
+    return files[0]["id"] if files else None
+
+def download_from_drive(file_id, file_path):
+    # Stream a Drive file to `file_path` in DRIVE_CHUNK_SIZE pieces
+    client = get_client()
+    request = client.drive.files().get_media(fileId=file_id)
+    request.http = client.drive_http()
+    partial_path = file_path + ".part"
+    with open(partial_path, "wb") as f:
+        downloader = MediaIoBaseDownload(f, request, chunksize=DRIVE_CHUNK_SIZE)
+        done = False
+        while not done:
+            _, done = governor.read("drive_download", "Drive", downloader.next_chunk, num_retries=3)
+    os.replace(partial_path, file_path)
+
+@pluggable
+def sheet_headers(sheet_name):
+    return list(sheet_cache.column_map(sheet_name))
+
+@pluggable
+def import_rows(sheet_name, rows):
+    # One append_rows call for a batch of bulk-imported rows, already checked
+    # for duplicates by the caller. Skips the write-behind queue on purpose.
+    with _booking_lock:
+        planned = sheet_cache.version(sheet_name)
+        governor.write("append_rows", sheet_name, open_worksheet(sheet_name).append_rows, rows)
+        sheet_cache.append_rows(sheet_name, rows, planned)
+
+@pluggable
+def read_pages(sheet_name, page_rows):
+    # The sheet's rows, header first, page_rows at a time: one ranged read per
+    # page, straight from the sheet and not kept in the cache
+    ws = open_worksheet(sheet_name)
+    start = 1
+    while True:
+        end = start + page_rows - 1
+        values = governor.read("get", sheet_name, ws.get, f"{start}:{end}")
+        if values:
+            yield values
+        if len(values) < page_rows:
+            return
+        start = end + 1
+
 def save_file_metadata(data):
-    ws = spreadsheet.worksheet("Files")
-    ws.append_row(data)
+    ws = open_worksheet("Files")
+    governor.write("append_row", "Files", ws.append_row, data)
 
+@pluggable
 def get_all_customers():
-    return spreadsheet.worksheet("Customer").get_all_records()
+    return sheet_cache.get_records("Customer")
 
+@pluggable
 def save_report(report_row):
-    worksheet = spreadsheet.worksheet("Report")
-    worksheet.append_row(report_row)
+    append_sheet_rows("Report", [report_row])
 
 
+@pluggable
 def get_all_reports():
-    sheet = spreadsheet.worksheet("Report")  # adjust sheet name as needed
-    data = sheet.get_all_records()  # This gives list of dicts based on headers row
-    return data
+    return sheet_cache.get_records("Report")  # list of dicts based on headers row
 
@@ -0,0 +1,142 @@
+# id_sequence.py
+# Hands out appointmentID, customerID and reportID values without downloading
+# the tables they belong to. The next free value of each sequence lives in a
+# small "Counters" worksheet; each process reserves a block of IDs from it and
+# serves them locally until the block runs out. A reservation is a versioned
+# write (see revisions.py): it only lands if no other process has reserved
+# since the counter was read, so two app instances never get the same block.
+import random
+import threading
+import time
+import gspread
+import streamlit as st
+
+from sheets_client import get_client, worksheet as open_worksheet
+import request_governor as governor
+import sheet_cache
+import revisions
+from storage import pluggable
+
+COUNTER_SHEET = "Counters"
+COUNTER_HEADERS = ["sequence", "nextValue"]
+
+# sequence name -> (worksheet, ID column) it numbers
+SEQUENCES = {
+    "customerID": ("Customer", "customerID"),
+    "appointmentID": ("Appointment", "appointmentID"),
+    "reportID": ("Report", "reportID"),
+}
+
+# IDs reserved per round trip. Values left in a block when the process stops are
+# skipped, so keep this at 1 for gap-free numbering on a single app instance.
+ID_BLOCK_SIZE = max(1, int(st.secrets.get("ID_BLOCK_SIZE", 1)))
+MAX_ATTEMPTS = 5
+
+_lock = threading.Lock()
+_blocks = {}        # sequence -> [next value, end (exclusive)]
+_counter_rows = {}  # sequence -> row number in the Counters sheet
+
+
+def _counter_sheet():
+    try:
+        return open_worksheet(COUNTER_SHEET)
+    except gspread.WorksheetNotFound:
+        client = get_client()
+        ws = governor.write("add_worksheet", COUNTER_SHEET, client.spreadsheet.add_worksheet,
+                            title=COUNTER_SHEET, rows=20, cols=len(COUNTER_HEADERS))
+        governor.write("append_row", COUNTER_SHEET, ws.append_row, COUNTER_HEADERS)
+        client.refresh_worksheets()
+        return ws
+
+
+def _column_max(sheet_name, col_name):
+    # Column-only read, used once to seed a sequence that has no counter yet
+    ws = open_worksheet(sheet_name)
+    headers = governor.read("row_values", sheet_name, ws.row_values, 1)
+    if col_name not in headers:
+        return 0
+    values = governor.read("col_values", sheet_name, ws.col_values, headers.index(col_name) + 1)[1:]
+    return max((int(v) for v in values if str(v).strip().isdigit()), default=0)
+
+
+def _find_counter_row(ws, sequence):
+    row = _counter_rows.get(sequence)
+    if row is not None:
+        return row
+    for idx, values in enumerate(governor.read("get_all_values", COUNTER_SHEET, ws.get_all_values)[1:], start=2):
+        if values and values[0] == sequence:
+            _counter_rows[sequence] = idx
+            return idx
+
+    sheet_name, col_name = SEQUENCES[sequence]
+    governor.write("append_row", COUNTER_SHEET, ws.append_row, [sequence, _column_max(sheet_name, col_name) + 1])
+    _counter_rows.pop(sequence, None)
+    return _find_counter_row(ws, sequence)
+
+
+def _reserve_block(sequence, size, floor=1):
+    ws = _counter_sheet()
+    row = _find_counter_row(ws, sequence)
+    cell_range = f"B{row}"
+
+    for attempt in range(MAX_ATTEMPTS):
+        # The counter is read together with the Counters revision, and the
+        # claim is written only if no other process has reserved since then
+        revision, (current,) = revisions.read(COUNTER_SHEET, [f"'{COUNTER_SHEET}'!{cell_range}"])
+        start = int(current[0][0]) if current and current[0] and str(current[0][0]).isdigit() else 1
+        start = max(start, floor)
+        claim = {"updateCells": {
+            "start": {"sheetId": ws.id, "rowIndex": row - 1, "columnIndex": 1},
+            "rows": [{"values": [{"userEnteredValue": {"numberValue": start + size}}]}],
+            "fields": "userEnteredValue",
+        }}
+        if revisions.commit(COUNTER_SHEET, "reserve_ids", [claim], revision):
+            return start, start + size
+        time.sleep(random.uniform(0.05, 0.2) * (attempt + 1))
+
+    raise revisions.WriteConflictError(f"Could not reserve a block of {sequence} values; please try again.")
+
+
+def _known_ids(sequence):
+    # IDs already present in the cached copy of the target sheet, if it is loaded
+    sheet_name, col_name = SEQUENCES[sequence]
+    records = sheet_cache.peek(sheet_name)
+    if not records:
+        return set()
+    return {str(r.get(col_name)) for r in records}
+
+
+@pluggable
+def next_id(sequence):
+    with _lock:
+        known = _known_ids(sequence)
+        floor = 1
+        for _ in range(MAX_ATTEMPTS):
+            block = _blocks.get(sequence)
+            if block is None or block[0] >= block[1]:
+                block = list(_reserve_block(sequence, ID_BLOCK_SIZE, floor))
+                _blocks[sequence] = block
+
+            value = block[0]
+            block[0] += 1
+            if str(value) not in known:
+                return value
+
+            # A row written outside the counter (e.g. typed into the sheet by hand)
+            # already uses this value: drop the block and move the counter past it
+            _blocks.pop(sequence, None)
+            floor = max(int(v) for v in known if v.isdigit()) + 1
+
+        raise revisions.WriteConflictError(f"Could not allocate a free {sequence}; please try again.")
+
+
+@pluggable
+def next_ids(sequence, count):
+    # A range of `count` fresh values in one reservation, for bulk imports.
+    # Starts above every ID in the cached copy of the target sheet.
+    if count <= 0:
+        return range(0)
+    with _lock:
+        known = [int(v) for v in _known_ids(sequence) if v.isdigit()]
+        start, end = _reserve_block(sequence, count, max(known, default=0) + 1)
+        return range(start, end)
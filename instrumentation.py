@@ -0,0 +1,166 @@
+# instrumentation.py
+# Per-rerun cost accounting. Streamlit runs app.py top to bottom on every
+# widget interaction; each run is timed, split into named sections, and every
+# request the governor sends during it is tagged with the current page.
+import json
+import threading
+import time
+import streamlit as st
+
+import request_governor as governor
+
+PERF_LOG_PATH = st.secrets.get("PERF_LOG_PATH", "")
+HISTORY_SIZE = 20
+
+_local = threading.local()
+_totals_lock = threading.Lock()
+_page_totals = {}   # page -> {"reruns", "calls", "errors", "api_ms", "bytes"}
+
+
+def _payload_size(result):
+    try:
+        return len(json.dumps(result, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _detailed():
+    return bool(PERF_LOG_PATH) or st.session_state.get("perf_panel", False)
+
+
+def _on_call(operation, worksheet, kind, elapsed_ms, error, result):
+    rerun = getattr(_local, "rerun", None)
+    if rerun is None:
+        return
+    rerun["calls"].append({
+        "operation": operation,
+        "worksheet": worksheet,
+        "kind": kind,
+        "ms": round(elapsed_ms, 1),
+        "bytes": _payload_size(result) if rerun["detailed"] and result is not None else 0,
+        "error": error,
+        "section": rerun["section"],
+    })
+    rerun["last_activity"] = time.perf_counter()
+
+
+governor.add_listener(_on_call)
+
+
+def _close(rerun, ended, interrupted):
+    rerun["sections"][rerun["section"]] = rerun["sections"].get(rerun["section"], 0) + (ended - rerun["section_started"]) * 1000
+    summary = {
+        "page": rerun["page"],
+        "started_at": rerun["started_at"],
+        "total_ms": round((ended - rerun["started"]) * 1000, 1),
+        "interrupted": interrupted,
+        "calls": len(rerun["calls"]),
+        "errors": sum(1 for c in rerun["calls"] if c["error"]),
+        "api_ms": round(sum(c["ms"] for c in rerun["calls"]), 1),
+        "bytes": sum(c["bytes"] for c in rerun["calls"]),
+        "sections": {name: round(ms, 1) for name, ms in rerun["sections"].items()},
+        "call_log": rerun["calls"],
+    }
+
+    with _totals_lock:
+        totals = _page_totals.setdefault(summary["page"], {"reruns": 0, "calls": 0, "errors": 0, "api_ms": 0.0, "bytes": 0})
+        totals["reruns"] += 1
+        totals["calls"] += summary["calls"]
+        totals["errors"] += summary["errors"]
+        totals["api_ms"] += summary["api_ms"]
+        totals["bytes"] += summary["bytes"]
+
+    history = st.session_state.setdefault("perf_history", [])
+    history.append(summary)
+    del history[:-HISTORY_SIZE]
+
+    if PERF_LOG_PATH:
+        with open(PERF_LOG_PATH, "a") as f:
+            f.write(json.dumps({**summary, "user": st.session_state.get("user_username", "")}) + "\n")
+    return summary
+
+
+def start_rerun():
+    # A rerun cut short by st.rerun() / st.stop() never reaches finish_rerun();
+    # close it here, ending at its last recorded activity
+    previous = st.session_state.get("perf_open")
+    if previous is not None:
+        _close(previous, previous["last_activity"], interrupted=True)
+
+    now = time.perf_counter()
+    rerun = {
+        "page": "",
+        "started_at": time.time(),
+        "started": now,
+        "last_activity": now,
+        "section": "setup",
+        "section_started": now,
+        "sections": {},
+        "calls": [],
+        "detailed": _detailed(),
+    }
+    st.session_state["perf_open"] = rerun
+    _local.rerun = rerun
+
+
+def set_page(page):
+    rerun = getattr(_local, "rerun", None)
+    if rerun is not None:
+        rerun["page"] = page
+
+
+def mark(section):
+    # End the current section and start timing `section`
+    rerun = getattr(_local, "rerun", None)
+    if rerun is None:
+        return
+    now = time.perf_counter()
+    rerun["sections"][rerun["section"]] = rerun["sections"].get(rerun["section"], 0) + (now - rerun["section_started"]) * 1000
+    rerun["section"] = section
+    rerun["section_started"] = now
+    rerun["last_activity"] = now
+
+
+def finish_rerun():
+    rerun = getattr(_local, "rerun", None)
+    _local.rerun = None
+    st.session_state.pop("perf_open", None)
+    if rerun is None:
+        return None
+    return _close(rerun, time.perf_counter(), interrupted=False)
+
+
+def page_totals():
+    with _totals_lock:
+        return {page: dict(totals) for page, totals in _page_totals.items()}
+
+
+def render_panel():
+    # Opt-in sidebar panel for pharmacists
+    if not st.sidebar.checkbox("📈 Show API cost panel", key="perf_panel"):
+        return
+    history = st.session_state.get("perf_history", [])
+    with st.sidebar.expander("API cost", expanded=True):
+        if not history:
+            st.write("No reruns recorded yet.")
+            return
+        last = history[-1]
+        st.markdown(
+            f"**Last rerun:** {last['page'] or '—'} · {last['total_ms']:.0f} ms · "
+            f"{last['calls']} calls · {last['api_ms']:.0f} ms in API · {last['bytes'] / 1024:.1f} KB"
+        )
+        st.caption("Sections (ms)")
+        st.json(last["sections"])
+        if last["call_log"]:
+            st.caption("Calls this rerun")
+            st.dataframe(last["call_log"])
+        st.caption("Recent reruns")
+        st.dataframe(
+            [{k: r[k] for k in ("page", "total_ms", "calls", "api_ms", "bytes", "interrupted")} for r in history],
+        )
+        st.caption("All sessions, per page")
+        st.dataframe([{"page": page, **totals} for page, totals in page_totals().items()])
+        st.caption("All sessions, per operation")
+        st.dataframe(
+            [{k: m[k] for k in ("operation", "worksheet", "count", "errors", "avg_ms", "max_ms")} for m in governor.metrics()],
+        )
@@ -0,0 +1,176 @@
+# referral_store.py
+# Referral letters, stored by content. An upload is streamed to
+# REFERRAL_DIR/<sha256><ext> in chunks, so the same letter uploaded twice is
+# kept once, and that path is what the appointment row records. The path is
+# worked out first and the file written only once the booking has succeeded.
+# A small worker pool then copies each new file to the Drive folder with a
+# resumable upload; booking never waits for it. Downloads are served from the local file, or
+# fetched from Drive by the same name when this server doesn't have it.
+import hashlib
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+
+from google_sheets import upload_to_drive, find_in_drive, download_from_drive
+from request_governor import QuotaExceededError
+
+REFERRAL_DIR = st.secrets.get("REFERRAL_DIR", "uploads")
+REFERRAL_INDEX_PATH = st.secrets.get("REFERRAL_INDEX_PATH", "referrals.db")
+DRIVE_UPLOAD = str(st.secrets.get("DRIVE_UPLOAD", "true")).lower() in ("1", "true", "yes")
+UPLOAD_WORKERS = int(st.secrets.get("DRIVE_UPLOAD_WORKERS", 2))
+CHUNK_SIZE = 1024 * 1024
+MAX_ATTEMPTS = 8
+MAX_BACKOFF = 300
+
+_lock = threading.Lock()
+_in_flight = set()  # file names queued or uploading in this process
+_pool = None
+
+
+def _connect():
+    conn = sqlite3.connect(REFERRAL_INDEX_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS uploads ("
+        " name TEXT PRIMARY KEY,"
+        " drive_id TEXT,"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " last_error TEXT)"
+    )
+    return conn
+
+
+def _start():
+    # Create the pool and resume uploads a previous run left unfinished
+    global _pool
+    if _pool is not None:
+        return
+    _pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="referral-upload")
+    conn = _connect()
+    try:
+        unfinished = [name for (name,) in conn.execute(
+            "SELECT name FROM uploads WHERE drive_id IS NULL AND attempts < ?", (MAX_ATTEMPTS,)
+        )]
+    finally:
+        conn.close()
+    for name in unfinished:
+        _submit(name)
+
+
+def _submit(name):
+    if name in _in_flight:
+        return
+    _in_flight.add(name)
+    _pool.submit(_upload, name)
+
+
+def _upload(name):
+    path = os.path.join(REFERRAL_DIR, name)
+    conn = _connect()
+    try:
+        while True:
+            if not os.path.exists(path):
+                conn.execute("UPDATE uploads SET last_error = ? WHERE name = ?", ("local file missing", name))
+                return
+            try:
+                # The name is the content hash: a file already in Drive is the same file
+                drive_id = find_in_drive(name) or upload_to_drive(path)
+                conn.execute("UPDATE uploads SET drive_id = ?, last_error = NULL WHERE name = ?", (drive_id, name))
+                return
+            except Exception as e:
+                conn.execute("UPDATE uploads SET attempts = attempts + 1, last_error = ? WHERE name = ?", (str(e), name))
+                (attempts,) = conn.execute("SELECT attempts FROM uploads WHERE name = ?", (name,)).fetchone()
+                if attempts >= MAX_ATTEMPTS:
+                    print(f"Giving up on Drive upload of {name} after {attempts} attempts ({e})")
+                    return
+                delay = min(MAX_BACKOFF, 2 ** attempts) * random.uniform(0.5, 1.5)
+                print(f"Drive upload of {name} failed ({e}); retrying in {delay:.0f}s")
+                time.sleep(delay)
+    finally:
+        conn.close()
+        with _lock:
+            _in_flight.discard(name)
+
+
+def _queue_upload(name):
+    if not DRIVE_UPLOAD:
+        return
+    conn = _connect()
+    try:
+        conn.execute("INSERT OR IGNORE INTO uploads (name) VALUES (?)", (name,))
+        (drive_id,) = conn.execute("SELECT drive_id FROM uploads WHERE name = ?", (name,)).fetchone()
+    finally:
+        conn.close()
+    if drive_id:
+        return
+    with _lock:
+        _start()
+        _submit(name)
+
+
+def _extension(uploaded_file):
+    return os.path.splitext(uploaded_file.name)[1].lower()
+
+
+def path_for(uploaded_file):
+    # The path store() will save this upload under, without writing anything,
+    # so the appointment can be booked before the letter is kept
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    return os.path.join(REFERRAL_DIR, digest.hexdigest() + _extension(uploaded_file))
+
+
+def store(uploaded_file):
+    # Save an uploaded file (anything with .name and .read()) and return its path
+    os.makedirs(REFERRAL_DIR, exist_ok=True)
+    extension = _extension(uploaded_file)
+    digest = hashlib.sha256()
+    fd, partial_path = tempfile.mkstemp(dir=REFERRAL_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            uploaded_file.seek(0)
+            for chunk in iter(lambda: uploaded_file.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        name = digest.hexdigest() + extension
+        path = os.path.join(REFERRAL_DIR, name)
+        if os.path.exists(path):
+            os.remove(partial_path)
+        else:
+            os.replace(partial_path, path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    _queue_upload(name)
+    return path
+
+
+def load(path):
+    # File contents for a download button, or None if the letter can't be found.
+    # Files missing here (another server, a wiped disk) are pulled from Drive
+    # and kept locally for next time.
+    if not path:
+        return None
+    if not os.path.exists(path):
+        try:
+            file_id = find_in_drive(os.path.basename(path))
+            if file_id is None:
+                return None
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            download_from_drive(file_id, path)
+        except QuotaExceededError:
+            raise
+        except Exception as e:
+            print(f"Could not fetch {path} from Drive: {e}")
+            return None
+    with open(path, "rb") as f:
+        return f.read()
+
@@ -0,0 +1,102 @@
+# report_index.py
+# Search over the Report sheet for the report viewer: an inverted index of
+# the words in reportContent plus lookups by customerID, appointmentID and
+# reportDate. Like user_directory, the index is rebuilt only when the sheet
+# is reloaded; reports appended since the last look are indexed on their own.
+import bisect
+import re
+import threading
+
+from google_sheets import get_all_reports
+import sheet_cache
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+_lock = threading.Lock()
+_state = {
+    "generation": None,
+    "docs": [],            # indexed reports, in sheet order; positions are doc ids
+    "tokens": {},          # word -> [doc id]
+    "by_customer": {},     # customerID as text -> [doc id]
+    "by_appointment": {},  # appointmentID as text -> [doc id]
+    "by_date": [],         # sorted [(reportDate as text, doc id)]
+}
+
+
+def tokenize(text):
+    return _TOKEN.findall(str(text).lower())
+
+
+def _index(records):
+    docs = _state["docs"]
+    tokens, by_customer, by_appointment = _state["tokens"], _state["by_customer"], _state["by_appointment"]
+    dates = []
+    for record in records:
+        doc_id = len(docs)
+        docs.append(record)
+        for token in set(tokenize(record.get("reportContent", ""))):
+            tokens.setdefault(token, []).append(doc_id)
+        by_customer.setdefault(str(record.get("customerID", "")), []).append(doc_id)
+        by_appointment.setdefault(str(record.get("appointmentID", "")), []).append(doc_id)
+        dates.append((str(record.get("reportDate", "")), doc_id))
+    if dates:
+        # Reports arrive roughly in date order, so this sort is close to linear
+        _state["by_date"].extend(dates)
+        _state["by_date"].sort()
+
+
+def _refresh():
+    records = get_all_reports()
+    generation = sheet_cache.generation("Report")
+
+    with _lock:
+        docs = _state["docs"]
+        # Pending write-behind rows come last and may be overtaken by rows
+        # synced from the sheet, so also check the last report indexed
+        appended_only = (
+            _state["generation"] == generation
+            and len(records) >= len(docs)
+            and (not docs or records[len(docs) - 1] == docs[-1])
+        )
+        if appended_only:
+            _index(records[len(docs):])
+        else:
+            _state.update(docs=[], tokens={}, by_customer={}, by_appointment={}, by_date=[])
+            _index(records)
+        _state["generation"] = generation
+        return _state
+
+
+def search(text="", customer_id=None, appointment_id=None, date_from=None, date_to=None, offset=0, limit=None):
+    # (number of matches, matching reports[offset:offset + limit]), newest
+    # first. `text` matches reports containing all of its words; dates are
+    # YYYY-MM-DD strings and the range includes both ends.
+    state = _refresh()
+    with _lock:
+        docs = state["docs"]
+        candidates = [state["tokens"].get(token, []) for token in set(tokenize(text))]
+        if customer_id not in (None, ""):
+            candidates.append(state["by_customer"].get(str(customer_id).strip(), []))
+        if appointment_id not in (None, ""):
+            candidates.append(state["by_appointment"].get(str(appointment_id).strip(), []))
+        if date_from or date_to:
+            by_date = state["by_date"]
+            start = bisect.bisect_left(by_date, (str(date_from or ""), -1))
+            end = bisect.bisect_right(by_date, (str(date_to or "\uffff"), len(docs)))
+            candidates.append([doc_id for _, doc_id in by_date[start:end]])
+
+        if not candidates:
+            total = len(docs)
+            doc_ids = range(total - 1, -1, -1)
+        else:
+            # Intersect starting from the shortest list
+            candidates.sort(key=len)
+            matched = set(candidates[0])
+            for ids in candidates[1:]:
+                matched.intersection_update(ids)
+                if not matched:
+                    break
+            total = len(matched)
+            doc_ids = sorted(matched, reverse=True)
+        end = None if limit is None else offset + limit
+        return total, [docs[doc_id] for doc_id in doc_ids[offset:end]]
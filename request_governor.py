@@ -0,0 +1,140 @@
+# request_governor.py
+# Every Google Sheets and Drive request goes through read() or write() here.
+# They keep the app inside the per-minute quota with a token bucket, retry
+# quota and transient server errors with jittered exponential backoff, and
+# record per (operation, worksheet) call counts, errors and latency.
+import random
+import threading
+import time
+import gspread
+import requests
+import streamlit as st
+from googleapiclient.errors import HttpError
+
+# Google's defaults are 60 read and 60 write requests per minute per user
+READS_PER_MINUTE = int(st.secrets.get("SHEETS_READS_PER_MINUTE", 60))
+WRITES_PER_MINUTE = int(st.secrets.get("SHEETS_WRITES_PER_MINUTE", 60))
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 32.0
+MAX_WAIT = 30.0   # longest a caller queues for a token before giving up
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+
+class QuotaExceededError(Exception):
+    # Raised when Google keeps rejecting requests for quota after all retries
+    pass
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = max(1, per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        deadline = time.monotonic() + MAX_WAIT
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                raise QuotaExceededError("Too many requests to Google Sheets right now; please try again shortly.")
+            time.sleep(wait)
+
+
+_buckets = {"read": TokenBucket(READS_PER_MINUTE), "write": TokenBucket(WRITES_PER_MINUTE)}
+_metrics_lock = threading.Lock()
+_metrics = {}   # (operation, worksheet) -> stats dict
+_listeners = []  # callables(operation, worksheet, kind, elapsed_ms, error, result)
+
+
+def _status(error):
+    if isinstance(error, gspread.exceptions.APIError):
+        return error.response.status_code
+    if isinstance(error, HttpError):
+        return int(error.resp.status)
+    return None
+
+
+def _retryable(kind, error):
+    # A write that failed with a server error may still have been applied, so
+    # only writes Google explicitly rejected for quota are sent again
+    if kind == "write":
+        return _status(error) == 429
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return _status(error) in RETRYABLE_STATUSES
+
+
+def _record(operation, worksheet, kind, elapsed_ms, error, result=None):
+    with _metrics_lock:
+        stats = _metrics.setdefault((operation, worksheet), {
+            "operation": operation,
+            "worksheet": worksheet,
+            "kind": kind,
+            "count": 0,
+            "errors": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+            "histogram": [0] * len(LATENCY_BUCKETS_MS),
+        })
+        stats["count"] += 1
+        stats["errors"] += 1 if error else 0
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                stats["histogram"][i] += 1
+                break
+    for listener in _listeners:
+        listener(operation, worksheet, kind, elapsed_ms, error, result)
+
+
+def _call(kind, operation, worksheet, fn, *args, **kwargs):
+    for attempt in range(MAX_RETRIES + 1):
+        _buckets[kind].acquire()
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            _record(operation, worksheet, kind, (time.perf_counter() - start) * 1000, True)
+            if not _retryable(kind, e) or attempt == MAX_RETRIES:
+                if _status(e) == 429:
+                    raise QuotaExceededError("Google Sheets quota exceeded; please try again in a minute.") from e
+                raise
+            time.sleep(min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.5))
+            continue
+        _record(operation, worksheet, kind, (time.perf_counter() - start) * 1000, False, result)
+        return result
+
+
+def read(operation, worksheet, fn, *args, **kwargs):
+    return _call("read", operation, worksheet, fn, *args, **kwargs)
+
+
+def write(operation, worksheet, fn, *args, **kwargs):
+    return _call("write", operation, worksheet, fn, *args, **kwargs)
+
+
+def add_listener(listener):
+    # listener(operation, worksheet, kind, elapsed_ms, error, result) runs after every attempt
+    _listeners.append(listener)
+
+
+def metrics():
+    # Copy of the per (operation, worksheet) stats, busiest first
+    with _metrics_lock:
+        rows = [{**stats, "histogram": list(stats["histogram"])} for stats in _metrics.values()]
+    for stats in rows:
+        stats["avg_ms"] = stats["total_ms"] / stats["count"] if stats["count"] else 0.0
+    return sorted(rows, key=lambda s: s["count"], reverse=True)
@@ -0,0 +1,233 @@
+# revisions.py
+# Optimistic concurrency for writes that address rows by position, so several
+# app replicas can share one spreadsheet. Every sheet written this way has a
+# revision number in the "Revisions" worksheet, plus a named range whose ID
+# carries that number. A write is a single batchUpdate that begins by deleting
+# the named range for the revision the write was planned against and adding
+# the one for the next revision. batchUpdate applies all of its requests or
+# none, so when another replica has written in between, the delete fails and
+# nothing is changed. The writer then re-reads only the revision and the rows
+# it meant to touch, finds them by key if they moved, and tries again. No lock
+# is held across replicas. Appends never move existing rows, so they skip this.
+import threading
+import time
+import gspread
+import streamlit as st
+from gspread.utils import rowcol_to_a1
+
+from sheets_client import get_client, worksheet as open_worksheet
+import request_governor as governor
+import sheet_cache
+
+REVISION_SHEET = "Revisions"
+REVISION_HEADERS = ["sheet", "revision"]
+MAX_ATTEMPTS = int(st.secrets.get("WRITE_CONFLICT_ATTEMPTS", 5))
+# Up to this many rows are checked one range each; beyond it the key columns are read instead
+VERIFY_ROWS = 50
+# How often (seconds) the cache looks again for a sheet with no revision yet
+LOOKUP_SECONDS = 300
+
+_lock = threading.Lock()
+_rows = {}  # sheet name -> row number in the Revisions sheet
+_looked_up_at = None  # monotonic time revision_range last read the Revisions sheet
+
+
+class WriteConflictError(RuntimeError):
+    pass
+
+
+def _revision_sheet():
+    try:
+        return open_worksheet(REVISION_SHEET)
+    except gspread.WorksheetNotFound:
+        client = get_client()
+        ws = governor.write("add_worksheet", REVISION_SHEET, client.spreadsheet.add_worksheet,
+                            title=REVISION_SHEET, rows=20, cols=len(REVISION_HEADERS))
+        governor.write("append_row", REVISION_SHEET, ws.append_row, REVISION_HEADERS)
+        client.refresh_worksheets()
+        return ws
+
+
+def _to_int(value):
+    return int(value) if str(value).strip().isdigit() else 0
+
+
+def _marker_id(sheet_name, revision):
+    # Named range IDs are unique per spreadsheet, so key them by the sheet's ID
+    return f"rev{open_worksheet(sheet_name).id}x{revision}"
+
+
+def _marker(sheet_name, revision):
+    row = _rows[sheet_name]
+    return {
+        "namedRangeId": _marker_id(sheet_name, revision),
+        "name": _marker_id(sheet_name, revision),
+        "range": {
+            "sheetId": _revision_sheet().id,
+            "startRowIndex": row - 1,
+            "endRowIndex": row,
+            "startColumnIndex": 1,
+            "endColumnIndex": 2,
+        },
+    }
+
+
+def _find_row(ws, sheet_name):
+    # Also notes the row of every other sheet listed, for revision_range
+    found = None, None
+    for idx, values in enumerate(governor.read("get_all_values", REVISION_SHEET, ws.get_all_values)[1:], start=2):
+        if not values:
+            continue
+        _rows.setdefault(values[0], idx)
+        if values[0] == sheet_name and found[0] is None:
+            found = idx, _to_int(values[1] if len(values) > 1 else "")
+    return found
+
+
+def _revision_row(sheet_name):
+    row = _rows.get(sheet_name)
+    if row is not None:
+        return row
+    with _lock:
+        ws = _revision_sheet()
+        row, revision = _find_row(ws, sheet_name)
+        added = row is None
+        if added:
+            # First versioned write to this sheet from any replica; if two
+            # replicas race here, both use the first row and one marker wins
+            governor.write("append_row", REVISION_SHEET, ws.append_row, [sheet_name, 0])
+            row, revision = _find_row(ws, sheet_name)
+        _rows[sheet_name] = row
+        if added:
+            _add_marker(sheet_name, revision)
+        return row
+
+
+def revision_range(sheet_name):
+    # A1 range of the sheet's revision number, so the read cache can tell
+    # when another replica has written; None while the sheet has none
+    global _looked_up_at
+    with _lock:
+        row = _rows.get(sheet_name)
+        if row is None and (_looked_up_at is None or time.monotonic() - _looked_up_at >= LOOKUP_SECONDS):
+            _looked_up_at = time.monotonic()
+            try:
+                row, _ = _find_row(open_worksheet(REVISION_SHEET), sheet_name)
+            except gspread.WorksheetNotFound:
+                pass
+    return None if row is None else f"'{REVISION_SHEET}'!B{row}"
+
+
+sheet_cache.set_revision_source(revision_range)
+
+
+def _add_marker(sheet_name, revision):
+    try:
+        governor.write("add_named_range", REVISION_SHEET, get_client().spreadsheet.batch_update,
+                       {"requests": [{"addNamedRange": {"namedRange": _marker(sheet_name, revision)}}]})
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code != 400:
+            raise  # 400: another replica added it first
+
+
+def read(sheet_name, ranges):
+    # (revision, [grid per range]) for ranges of any sheet, read together with
+    # the revision of `sheet_name` in one request, so they belong to it
+    row = _revision_row(sheet_name)
+    response = governor.read(
+        "values_batch_get", sheet_name, get_client().spreadsheet.values_batch_get,
+        [f"'{REVISION_SHEET}'!B{row}"] + list(ranges),
+    )
+    grids = [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
+    grids += [[]] * (len(ranges) + 1 - len(grids))
+    revision = _to_int(grids[0][0][0]) if grids[0] and grids[0][0] else 0
+    return revision, grids[1:]
+
+
+def _is_conflict(error):
+    return error.response.status_code == 400 and "deleteNamedRange" in str(error)
+
+
+def commit(sheet_name, label, requests, revision):
+    # Sends `requests` in one batchUpdate if the sheet is still at `revision`,
+    # moving it to the next one. False, with nothing applied, if it isn't.
+    row = _revision_row(sheet_name)
+    bump = [
+        {"deleteNamedRange": {"namedRangeId": _marker_id(sheet_name, revision)}},
+        {"addNamedRange": {"namedRange": _marker(sheet_name, revision + 1)}},
+        {"updateCells": {
+            "start": {"sheetId": _revision_sheet().id, "rowIndex": row - 1, "columnIndex": 1},
+            "rows": [{"values": [{"userEnteredValue": {"numberValue": revision + 1}}]}],
+            "fields": "userEnteredValue",
+        }},
+    ]
+    try:
+        governor.write(label, sheet_name, get_client().spreadsheet.batch_update, {"requests": bump + list(requests)})
+    except gspread.exceptions.APIError as e:
+        if not _is_conflict(e):
+            raise
+        # Someone else's write landed first; if the marker is missing
+        # altogether (deleted by hand), put back the one for this revision
+        latest, _ = read(sheet_name, [])
+        if latest == revision:
+            _add_marker(sheet_name, revision)
+        return False
+    sheet_cache.revised(sheet_name, revision, revision + 1)
+    return True
+
+
+def _column_letter(col):
+    return rowcol_to_a1(1, col).rstrip("0123456789")
+
+
+def _locate(sheet_name, keys, key_fn, key_columns):
+    # Revision and {key: row number}, from the key columns only
+    headers = list(sheet_cache.column_map(sheet_name))
+    cols = [headers.index(name) + 1 for name in key_columns]
+    first, last = min(cols), max(cols)
+    revision, (grid,) = read(sheet_name, [f"'{sheet_name}'!{_column_letter(first)}2:{_column_letter(last)}"])
+    span = headers[first - 1:last]
+    wanted = set(keys)
+    located = {}
+    for row_number, values in enumerate(grid, start=2):  # offset header
+        key = key_fn(dict(zip(span, list(values) + [""] * (len(span) - len(values)))))
+        if key in wanted:
+            located.setdefault(key, row_number)
+    return revision, located
+
+
+def _verify(sheet_name, positions, key_fn):
+    # Revision, and whether every row still holds the key it was found under
+    headers = list(sheet_cache.column_map(sheet_name))
+    revision, grids = read(sheet_name, [f"'{sheet_name}'!{row}:{row}" for row in positions.values()])
+    for key, grid in zip(positions, grids):
+        values = list(grid[0]) if grid else []
+        record = dict(zip(headers, values + [""] * (len(headers) - len(values))))
+        if key_fn(record) != key:
+            return revision, False
+    return revision, True
+
+
+def write_rows(sheet_name, label, keys, key_fn, key_columns, plan):
+    # Versioned write of the rows whose key_fn(record) is in `keys`.
+    # plan({key: row number}) returns the batchUpdate requests for the rows
+    # found (keys no longer in the sheet are left out), or [] to write nothing.
+    # Each attempt checks the rows against the sheet at the revision it then
+    # commits to. Returns the {key: row number} that was written; when rows
+    # had moved, the cached copy of the sheet is dropped.
+    keys = list(dict.fromkeys(keys))
+    index = sheet_cache.row_index(sheet_name, key_fn)
+    positions = {key: index[key] for key in keys if key in index}
+    for _ in range(MAX_ATTEMPTS):
+        verified = False
+        if positions and len(positions) == len(keys) and len(keys) <= VERIFY_ROWS:
+            revision, verified = _verify(sheet_name, positions, key_fn)
+        if not verified:
+            revision, located = _locate(sheet_name, keys, key_fn, key_columns)
+            if located != positions:
+                positions = located
+                sheet_cache.invalidate(sheet_name)
+        requests = plan(positions)
+        if not requests or commit(sheet_name, label, requests, revision):
+            return positions
+    raise WriteConflictError(f"{sheet_name} kept changing while saving; please try again.")
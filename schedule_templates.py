@@ -0,0 +1,39 @@
+# schedule_templates.py
+# Weekly slot templates: a set of weekdays and timeslots, expanded over a
+# date range in memory with holidays skipped. google_sheets.add_schedule_slots
+# then drops the slots that already exist (or are booked) with a set
+# difference and writes the rest to Schedule in a single append.
+from datetime import datetime, timedelta
+import streamlit as st
+
+from availability import TIMESLOTS
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+DEFAULT_WEEKDAYS = WEEKDAYS[:6]
+
+# Public holidays to leave out, as YYYY-MM-DD strings
+HOLIDAYS = [str(day) for day in st.secrets.get("HOLIDAYS", [])]
+
+
+def parse_dates(text):
+    # "2025-01-01, 2025-02-10" or one date per line -> set of dates
+    days = set()
+    for part in text.replace(",", "\n").splitlines():
+        part = part.strip()
+        if part:
+            days.add(datetime.strptime(part, "%Y-%m-%d").date())
+    return days
+
+
+def expand(start, end, weekdays, timeslots, holidays=()):
+    # [(YYYY-MM-DD, timeslot)] for every chosen weekday from start to end inclusive
+    chosen = {WEEKDAYS.index(day) for day in weekdays}
+    timeslots = [slot for slot in TIMESLOTS if slot in timeslots] + [slot for slot in timeslots if slot not in TIMESLOTS]
+    skipped = set(holidays)
+    slots = []
+    day = start
+    while day <= end:
+        if day.weekday() in chosen and day not in skipped:
+            slots.extend((day.isoformat(), slot) for slot in timeslots)
+        day += timedelta(days=1)
+    return slots
@@ -0,0 +1,371 @@
+# sheet_cache.py
+# Process-wide read cache for worksheet records. Streamlit imports this module
+# once per server process, so every user session shares the same entries.
+#
+# Sheets listed in DELTA_SYNC_SHEETS are mostly append-only. When their cache
+# expires only the rows after the last one already held are downloaded, along
+# with the header, that last row and a few random rows to check against. A
+# full reload happens when a check fails or FULL_RESYNC_SECONDS have passed.
+# Appointment is left out by default: its rows are edited in place (status,
+# reschedules), which a few sampled rows would mostly miss. The same request
+# reads the sheet's revision number when it has one (see revisions.py); if
+# another replica's write has moved it, the sheet is reloaded in full.
+import random
+import threading
+import time
+import streamlit as st
+from gspread.utils import numericise_all, rowcol_to_a1
+
+from sheets_client import get_client
+import request_governor as governor
+
+# How long (seconds) cached records are served before the next read refetches them
+CACHE_TTL = float(st.secrets.get("CACHE_TTL_SECONDS", 60))
+DELTA_SYNC_SHEETS = {
+    name.strip() for name in str(st.secrets.get("DELTA_SYNC_SHEETS", "Schedule,Report")).split(",")
+    if name.strip()
+}
+SYNC_SAMPLE_ROWS = int(st.secrets.get("SYNC_SAMPLE_ROWS", 3))
+FULL_RESYNC_SECONDS = float(st.secrets.get("FULL_RESYNC_SECONDS", 900))
+
+_lock = threading.Lock()
+_sheet_locks = {}
+_entries = {}      # sheet name -> {"records": [...], "loaded_at": monotonic time, "synced_at": last full load, "revision": ...}
+_versions = {}     # sheet name -> int, bumped whenever the cached data changes
+_generations = {}  # sheet name -> int, bumped when cached rows are reloaded or removed (not on appends or field patches)
+_headers = {}      # sheet name -> header row, kept even when the sheet has no data rows
+_indexes = {}      # (sheet name, index name) -> (version, {key: row number})
+_overlays = []     # callables returning rows written but not yet in the sheet
+_revision_source = None  # callable: sheet name -> A1 range of its revision number, or None
+_outside = {}      # sheet name -> int, bumped when a reload finds changes this process didn't make
+
+
+def _sheet_lock(sheet_name):
+    with _lock:
+        return _sheet_locks.setdefault(sheet_name, threading.Lock())
+
+
+def _is_fresh(entry):
+    return entry is not None and time.monotonic() - entry["loaded_at"] < CACHE_TTL
+
+
+def _to_record(keys, row):
+    # Same shape as gspread's get_all_records(): padded to the header, numbers parsed
+    row = [str(v) for v in row] + [""] * (len(keys) - len(row))
+    return dict(zip(keys, numericise_all(row[:len(keys)])))
+
+
+def _to_records(values):
+    if not values:
+        return []
+    keys = values[0]
+    return [_to_record(keys, row) for row in values[1:]]
+
+
+def _batch_get(label, ranges):
+    # One values:batchGet call; a list of cell grids in the order of `ranges`
+    response = governor.read("values_batch_get", label, get_client().spreadsheet.values_batch_get, ranges)
+    return [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
+
+
+def _fetch(sheet_names):
+    grids = _batch_get(",".join(sheet_names), [f"'{name}'" for name in sheet_names])
+    return {name: _to_records(grid) for name, grid in zip(sheet_names, grids)}
+
+
+def _cell(grid):
+    return str(grid[0][0]) if grid and grid[0] else ""
+
+
+def _revision_range(sheet_name):
+    if _revision_source is None or sheet_name not in DELTA_SYNC_SHEETS:
+        return None
+    return _revision_source(sheet_name)
+
+
+def _delta_plan(sheet_name, entry):
+    # Ranges for an incremental refresh of a cached sheet, or None if it
+    # needs a full load
+    if sheet_name not in DELTA_SYNC_SHEETS or entry is None or not entry["records"]:
+        return None
+    if time.monotonic() - entry["synced_at"] >= FULL_RESYNC_SECONDS:
+        return None
+    records = entry["records"]
+    keys = list(records[0].keys())
+    last_col = rowcol_to_a1(1, len(keys)).rstrip("0123456789")
+    last_row = len(records) + 1
+    samples = random.sample(range(2, last_row), min(SYNC_SAMPLE_ROWS, last_row - 2))
+    return {
+        "records": records,
+        "revision": entry.get("revision"),
+        "keys": keys,
+        "samples": samples,
+        "ranges": [f"'{sheet_name}'!1:1", f"'{sheet_name}'!A{last_row}:{last_col}"]
+        + [f"'{sheet_name}'!A{row}:{last_col}{row}" for row in samples],
+    }
+
+
+def _apply_delta(plan, grids):
+    # New records appended after the cached ones, or None if the sheet
+    # changed in some other way (edited, deleted, reordered, new columns)
+    header, tail, *samples = grids
+    records, keys = plan["records"], plan["keys"]
+    if not header or header[0] != keys:
+        return None
+    if not tail or _to_record(keys, tail[0]) != records[-1]:
+        return None
+    for row_number, grid in zip(plan["samples"], samples):
+        if _to_record(keys, grid[0] if grid else []) != records[row_number - 2]:
+            return None
+    return [_to_record(keys, row) for row in tail[1:]]
+
+
+def prefetch(sheet_names):
+    # Load every stale sheet in `sheet_names` with a single round trip
+    stale = sorted({name for name in sheet_names if not _is_fresh(_entries.get(name))})
+    if not stale:
+        return
+
+    # Only one session refetches an expired sheet; the others wait for its result
+    locks = [_sheet_lock(name) for name in stale]
+    for lock in locks:
+        lock.acquire()
+    try:
+        stale = [name for name in stale if not _is_fresh(_entries.get(name))]
+        if not stale:
+            return
+
+        started = {name: _versions.get(name, 0) for name in stale}
+        plans = {name: _delta_plan(name, _entries.get(name)) for name in stale}
+        cells = {name: _revision_range(name) for name in stale}
+        full = [name for name in stale if plans[name] is None]
+        ranges = [f"'{name}'" for name in full]
+        for name in stale:
+            if plans[name] is not None:
+                ranges += plans[name]["ranges"]
+        tracked = [name for name in stale if cells[name]]
+        ranges += [cells[name] for name in tracked]
+        grids = iter(_batch_get(",".join(stale), ranges))
+
+        fetched = {name: _to_records(next(grids)) for name in full}
+        appended = {}
+        for name in stale:
+            if plans[name] is not None:
+                appended[name] = _apply_delta(plans[name], [next(grids) for _ in plans[name]["ranges"]])
+        latest = {name: _cell(next(grids)) for name in tracked}
+        for name in tracked:
+            # Another replica has written since this copy was loaded
+            if plans[name] is not None and plans[name]["revision"] != latest[name]:
+                appended[name] = None
+        resync = [name for name, rows in appended.items() if rows is None]
+        if resync:
+            fetched.update(_fetch(resync))
+
+        now = time.monotonic()
+        with _lock:
+            for name in stale:
+                # A write that landed while we were downloading makes this copy stale
+                if _versions.get(name, 0) != started[name]:
+                    continue
+                # The app's own writes are already patched in, so any difference came from outside
+                previous = _entries.get(name)
+                if previous is not None:
+                    changed = fetched[name] != previous["records"] if name in fetched else bool(appended[name])
+                    if changed:
+                        _outside[name] = _outside.get(name, 0) + 1
+                if name in fetched:
+                    _entries[name] = {
+                        "records": fetched[name], "loaded_at": now, "synced_at": now, "revision": latest.get(name),
+                    }
+                    _versions[name] = started[name] + 1
+                    _generations[name] = _generations.get(name, 0) + 1
+                    continue
+                entry = _entries[name]
+                if appended[name]:
+                    entry["records"] = entry["records"] + appended[name]
+                    _versions[name] = started[name] + 1
+                entry["loaded_at"] = now
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
+def _sheet_records(sheet_name):
+    entry = _entries.get(sheet_name)
+    if _is_fresh(entry):
+        return entry["records"]
+
+    prefetch([sheet_name])
+    entry = _entries.get(sheet_name)
+    if entry is not None:
+        return entry["records"]
+    # Lost a race with a concurrent write; serve this read uncached
+    return _fetch([sheet_name])[sheet_name]
+
+
+def _pending_records(sheet_name, records):
+    rows = [row for overlay in _overlays for row in overlay(sheet_name)]
+    if not rows:
+        return []
+    keys = list(records[0].keys()) if records else _headers.get(sheet_name)
+    if not keys:
+        keys = column_map(sheet_name)
+    return [_to_record(list(keys), row) for row in rows]
+
+
+def get_records(sheet_name):
+    # Rows in the sheet followed by rows still waiting to be written to it.
+    # Callers share the returned list, so treat it as read-only.
+    records = _sheet_records(sheet_name)
+    pending = _pending_records(sheet_name, records) if _overlays else []
+    return records + pending if pending else records
+
+
+def snapshot(sheet_name):
+    # Records and the version they belong to, read together (version is None
+    # when the read raced a write and was served uncached). Pending rows are
+    # left out: they have no row number yet.
+    records = _sheet_records(sheet_name)
+    with _lock:
+        entry = _entries.get(sheet_name)
+        if entry is not None:
+            return entry["records"], _versions.get(sheet_name, 0)
+    return records, None
+
+
+def column_map(sheet_name):
+    # Header name -> 1-based column number
+    headers = _headers.get(sheet_name)
+    if headers is None:
+        records = _sheet_records(sheet_name)
+        if records:
+            headers = list(records[0].keys())
+        else:
+            headers = governor.read("row_values", sheet_name, get_client().worksheet(sheet_name).row_values, 1)
+        _headers[sheet_name] = headers
+    return {name: col for col, name in enumerate(headers, start=1)}
+
+
+def row_index(sheet_name, key_fn):
+    # {key_fn(record): sheet row number}, rebuilt once per data version.
+    # The first row wins when several records share a key.
+    records, ver = snapshot(sheet_name)
+    cache_key = (sheet_name, key_fn.__qualname__)
+    cached = _indexes.get(cache_key)
+    if cached is not None and ver is not None and cached[0] == ver:
+        return cached[1]
+
+    index = {}
+    for row_number, record in enumerate(records, start=2):  # offset header
+        index.setdefault(key_fn(record), row_number)
+    if ver is not None:
+        _indexes[cache_key] = (ver, index)
+    return index
+
+
+def peek(sheet_name):
+    # Cached records if the sheet is loaded and fresh, without ever fetching
+    entry = _entries.get(sheet_name)
+    return entry["records"] if _is_fresh(entry) else None
+
+
+def _patchable(sheet_name, planned):
+    # The cached copy to patch for a write made while the sheet was at version
+    # `planned` (sheet_cache.version() read before the write was sent), or None.
+    # If the copy changed since, a reload may already hold the write, so it is
+    # dropped instead of patched twice. Call with _lock held.
+    current = _versions.get(sheet_name, 0)
+    _versions[sheet_name] = current + 1
+    entry = _entries.get(sheet_name)
+    if entry is not None and current != planned:
+        _entries.pop(sheet_name)
+        _generations[sheet_name] = _generations.get(sheet_name, 0) + 1
+        return None
+    return entry
+
+
+def append_rows(sheet_name, rows, planned):
+    # Patch rows the app has just appended into the cached copy, so the next
+    # read sees them without downloading the sheet again
+    with _lock:
+        entry = _patchable(sheet_name, planned)
+        if entry is None:
+            return
+        keys = list(entry["records"][0].keys()) if entry["records"] else _headers.get(sheet_name)
+        if not keys:
+            # No header to map the values onto; reload on next read
+            _entries.pop(sheet_name, None)
+            _generations[sheet_name] = _generations.get(sheet_name, 0) + 1
+            return
+        entry["records"] = entry["records"] + [_to_record(keys, row) for row in rows]
+
+
+def update_rows(sheet_name, changes, planned):
+    # Patch fields the app has just written: changes = {row number: {column: value}}
+    with _lock:
+        entry = _patchable(sheet_name, planned)
+        if entry is None:
+            return
+        records = list(entry["records"])
+        for row_number, fields in changes.items():
+            pos = row_number - 2
+            if 0 <= pos < len(records):
+                records[pos] = {**records[pos], **fields}
+        entry["records"] = records
+
+
+def delete_rows(sheet_name, row_numbers, planned):
+    # Drop rows the app has just deleted from the sheet
+    with _lock:
+        _generations[sheet_name] = _generations.get(sheet_name, 0) + 1
+        entry = _patchable(sheet_name, planned)
+        if entry is None:
+            return
+        removed = {row_number - 2 for row_number in row_numbers}
+        entry["records"] = [r for pos, r in enumerate(entry["records"]) if pos not in removed]
+
+
+def touch(sheet_name):
+    # Mark data derived from this sheet as outdated without dropping the cache
+    with _lock:
+        _versions[sheet_name] = _versions.get(sheet_name, 0) + 1
+
+
+def add_overlay(pending_rows):
+    _overlays.append(pending_rows)
+
+
+def set_revision_source(revision_range):
+    global _revision_source
+    _revision_source = revision_range
+
+
+def revised(sheet_name, before, after):
+    # The app's own versioned write moved the sheet from revision `before` to
+    # `after`; a copy loaded at `before` is current once that write is patched in
+    with _lock:
+        entry = _entries.get(sheet_name)
+        if entry is not None and entry.get("revision") == str(before):
+            entry["revision"] = str(after)
+
+
+def invalidate(sheet_name):
+    with _lock:
+        _entries.pop(sheet_name, None)
+        _versions[sheet_name] = _versions.get(sheet_name, 0) + 1
+        _generations[sheet_name] = _generations.get(sheet_name, 0) + 1
+
+
+def version(sheet_name):
+    return _versions.get(sheet_name, 0)
+
+
+def outside_changes(sheet_name):
+    # Bumped each time a reload brings in rows that were added, changed or
+    # removed by someone else (another replica, or an edit in the spreadsheet)
+    return _outside.get(sheet_name, 0)
+
+
+def generation(sheet_name):
+    # Unchanged generation + longer record list means rows were only appended
+    return _generations.get(sheet_name, 0)
@@ -1,21 +1,107 @@
 # sheets_client.py
 import json
+import threading
 import streamlit as st
 import gspread
+import google_auth_httplib2
+import httplib2
 from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
+
+import request_governor as governor
 
 scope = [
     "https://spreadsheets.google.com/feeds",
     "https://www.googleapis.com/auth/drive"
 ]
 
-# Load and parse the service account JSON from Streamlit secrets
-service_account_info = json.loads(st.secrets["GOOGLE_SERVICE_ACCOUNT"])
-creds = Credentials.from_service_account_info(service_account_info, scopes=scope)
-client = gspread.authorize(creds)
 
-# Access your spreadsheet by ID from secrets
-spreadsheet = client.open_by_key(st.secrets["SPREADSHEET_ID"])
+class SheetsClient:
+    # Nothing touches the network until the first worksheet or Drive call, so the
+    # app can render its shell before connecting. After that the gspread session,
+    # the worksheet handles and the Drive service are reused by every caller.
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._creds = None
+        self._client = None
+        self._spreadsheet = None
+        self._worksheets = None
+        self._drive = None
+        self._local = threading.local()
+
+    @property
+    def creds(self):
+        with self._lock:
+            if self._creds is None:
+                # Load and parse the service account JSON from Streamlit secrets
+                service_account_info = json.loads(st.secrets["GOOGLE_SERVICE_ACCOUNT"])
+                self._creds = Credentials.from_service_account_info(service_account_info, scopes=scope)
+            return self._creds
+
+    @property
+    def spreadsheet(self):
+        with self._lock:
+            if self._spreadsheet is None:
+                # gspread keeps one authorized HTTP session for all requests
+                self._client = gspread.authorize(self.creds)
+                self._spreadsheet = governor.read("open_by_key", "", self._client.open_by_key, st.secrets["SPREADSHEET_ID"])
+            return self._spreadsheet
+
+    def worksheet(self, name):
+        handles = self._worksheets
+        if handles is None or name not in handles:
+            handles = self.refresh_worksheets()
+        if name not in handles:
+            # Raises gspread.WorksheetNotFound with the usual message
+            return governor.read("worksheet", name, self.spreadsheet.worksheet, name)
+        return handles[name]
+
+    def refresh_worksheets(self):
+        # One metadata fetch builds handles for every tab in the spreadsheet
+        with self._lock:
+            self._worksheets = {ws.title: ws for ws in governor.read("worksheets", "", self.spreadsheet.worksheets)}
+            return self._worksheets
+
+    def attach(self, spreadsheet):
+        # Use an already-open spreadsheet (or an offline stand-in) instead of connecting
+        with self._lock:
+            self._spreadsheet = spreadsheet
+            self._worksheets = None
+
+    @property
+    def drive(self):
+        with self._lock:
+            if self._drive is None:
+                self._drive = build("drive", "v3", credentials=self.creds, cache_discovery=False)
+            return self._drive
+
+    def drive_http(self):
+        # httplib2 connections are not thread-safe, so each thread executes
+        # Drive requests on its own authorized connection
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+
+_client = SheetsClient()
+
+
+def get_client():
+    return _client
+
+
+def worksheet(name):
+    return _client.worksheet(name)
+
+
+def __getattr__(name):
+    # Older imports of `spreadsheet` / `creds` still work, but connect on access
+    if name in ("spreadsheet", "creds"):
+        return getattr(_client, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-# Also expose creds for Google Drive use
-__all__ = ["spreadsheet", "creds"]
+__all__ = ["SheetsClient", "get_client", "worksheet"]
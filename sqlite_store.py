@@ -0,0 +1,504 @@
+# sqlite_store.py
+# Local SQLite storage engine, selected with STORAGE_BACKEND = "sqlite". It
+# implements the same functions as google_sheets.py / auth.py / availability.py
+# so storage.pluggable can forward calls here. Tables keep the worksheet names
+# and headers, so records look exactly like the ones read from Sheets.
+#
+# On first start an empty database is filled from the spreadsheet. With
+# SQLITE_SHEETS_MIRROR on, changed tables are pushed back to their worksheets
+# every SQLITE_MIRROR_SECONDS so staff can keep reading the spreadsheet.
+import re
+import sqlite3
+import threading
+import time
+import streamlit as st
+
+from availability import timeslot_sort_key
+from sheets_client import get_client, worksheet as open_worksheet
+import request_governor as governor
+import analytics
+
+SQLITE_PATH = st.secrets.get("SQLITE_PATH", "clinic.db")
+SHEETS_MIRROR = str(st.secrets.get("SQLITE_SHEETS_MIRROR", "false")).lower() in ("1", "true", "yes")
+MIRROR_INTERVAL = float(st.secrets.get("SQLITE_MIRROR_SECONDS", 300))
+IMPORT_FROM_SHEETS = str(st.secrets.get("SQLITE_IMPORT_FROM_SHEETS", "true")).lower() in ("1", "true", "yes")
+
+# Default headers, used when a table is created without a worksheet to copy from
+HEADERS = {
+    "Customer": ["customerID", "customerUsername", "customerPassword", "customerName",
+                 "customerEmail", "customerNumber", "customerReferral"],
+    "Pharmacist": ["pharmacistID", "pharmacistUsername", "pharmacistPassword", "pharmacistName", "pharmacistEmail"],
+    "Appointment": ["appointmentID", "customerID", "appointmentDate", "appointmentTime",
+                    "appointmentStatus", "appointmentReferralLetter"],
+    "Schedule": ["availableDate", "availableTimeslot"],
+    "Report": ["reportID", "customerID", "appointmentID", "reportDate", "reportContent"],
+}
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS customer_username ON "Customer" ("customerUsername")',
+    'CREATE INDEX IF NOT EXISTS customer_email ON "Customer" (lower(trim("customerEmail")))',
+    'CREATE INDEX IF NOT EXISTS customer_id ON "Customer" ("customerID")',
+    'CREATE INDEX IF NOT EXISTS pharmacist_username ON "Pharmacist" ("pharmacistUsername")',
+    'CREATE UNIQUE INDEX IF NOT EXISTS appointment_id ON "Appointment" ("appointmentID")',
+    'CREATE INDEX IF NOT EXISTS appointment_customer ON "Appointment" ("customerID")',
+    'CREATE INDEX IF NOT EXISTS appointment_status ON "Appointment" ("appointmentStatus")',
+    # Slots are matched trimmed and lower-cased; replaces the plain appointment_slot index
+    'DROP INDEX IF EXISTS appointment_slot',
+    'CREATE INDEX IF NOT EXISTS appointment_slot_key ON "Appointment" '
+    '(lower(trim("appointmentDate")), lower(trim("appointmentTime")))',
+    'CREATE INDEX IF NOT EXISTS schedule_slot ON "Schedule" '
+    '(lower(trim("availableDate")), lower(trim("availableTimeslot")))',
+    'CREATE INDEX IF NOT EXISTS report_id ON "Report" ("reportID")',
+    'CREATE INDEX IF NOT EXISTS report_customer ON "Report" ("customerID")',
+    'CREATE INDEX IF NOT EXISTS report_appointment ON "Report" ("appointmentID")',
+]
+
+# sequence name -> (table, column)
+SEQUENCES = {
+    "customerID": ("Customer", "customerID"),
+    "appointmentID": ("Appointment", "appointmentID"),
+    "reportID": ("Report", "reportID"),
+}
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_ ]*$")
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+_dirty = set()    # tables changed since the last mirror push
+_dirty_lock = threading.Lock()
+_mirror = None
+
+
+def _quote(name):
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Unsupported column name {name!r}")
+    return f'"{name}"'
+
+
+def _column_type(name):
+    return "INTEGER" if name.endswith("ID") else "TEXT"
+
+
+def _create_table(conn, table, headers):
+    columns = ", ".join(f"{_quote(h)} {_column_type(h)}" for h in headers)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({columns})")
+
+
+def _import_from_sheets(conn):
+    # One values:batchGet for every worksheet, then bulk inserts
+    tables = list(HEADERS)
+    response = governor.read(
+        "values_batch_get", ",".join(tables),
+        get_client().spreadsheet.values_batch_get, [f"'{t}'" for t in tables],
+    )
+    for table, value_range in zip(tables, response.get("valueRanges", [])):
+        values = value_range.get("values", [])
+        headers = values[0] if values and values[0] else HEADERS[table]
+        _create_table(conn, table, headers)
+        rows = [(row + [""] * len(headers))[:len(headers)] for row in values[1:]]
+        if rows:
+            placeholders = ", ".join("?" for _ in headers)
+            conn.executemany(f"INSERT INTO {_quote(table)} VALUES ({placeholders})", rows)
+
+
+def _setup(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    with conn:
+        if IMPORT_FROM_SHEETS and not existing.intersection(HEADERS):
+            _import_from_sheets(conn)
+        for table, headers in HEADERS.items():
+            _create_table(conn, table, headers)
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (sequence TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        for statement in INDEXES:
+            conn.execute(statement)
+
+
+def _connect():
+    # One connection per thread; the first one creates and fills the database
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(SQLITE_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        with _init_lock:
+            if not _initialized:
+                _setup(conn)
+                _initialized = True
+                _start_mirror()
+        _local.conn = conn
+    return conn
+
+
+class _write:
+    # BEGIN IMMEDIATE ... COMMIT: takes the database write lock up front so
+    # check-then-write sequences are atomic across threads and processes
+    def __init__(self, *tables):
+        self.tables = tables
+
+    def __enter__(self):
+        self.conn = _connect()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+            with _dirty_lock:
+                _dirty.update(self.tables)
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")]
+
+
+def _insert(conn, table, row):
+    headers = _columns(conn, table)
+    row = (list(row) + [""] * len(headers))[:len(headers)]
+    placeholders = ", ".join("?" for _ in headers)
+    conn.execute(f"INSERT INTO {_quote(table)} VALUES ({placeholders})", row)
+
+
+def _select(sql, params=()):
+    return [dict(row) for row in _connect().execute(sql, params)]
+
+
+def _next_value(conn, sequence):
+    table, column = SEQUENCES[sequence]
+    row = conn.execute("SELECT value FROM counters WHERE sequence = ?", (sequence,)).fetchone()
+    if row is None:
+        # Seed from the table once; the index on the ID column makes this a lookup
+        current = conn.execute(f"SELECT COALESCE(MAX({_quote(column)}), 0) FROM {_quote(table)}").fetchone()[0]
+        value = int(current or 0) + 1
+        conn.execute("INSERT INTO counters (sequence, value) VALUES (?, ?)", (sequence, value + 1))
+        return value
+    conn.execute("UPDATE counters SET value = value + 1 WHERE sequence = ?", (sequence,))
+    return row["value"]
+
+
+# --------------------------------------------
+# IDs
+
+def next_id(sequence):
+    with _write() as conn:
+        return _next_value(conn, sequence)
+
+
+def next_ids(sequence, count):
+    if count <= 0:
+        return range(0)
+    with _write() as conn:
+        start = _next_value(conn, sequence)
+        conn.execute("UPDATE counters SET value = value + ? WHERE sequence = ?", (count - 1, sequence))
+    return range(start, start + count)
+
+
+# --------------------------------------------
+# Customers and login
+
+def save_customer(data):
+    with _write("Customer") as conn:
+        customer_id = _next_value(conn, "customerID")
+        _insert(conn, "Customer", [customer_id] + data)
+    return customer_id
+
+
+def register_user(username, password, full_name, email, phone):
+    return save_customer([username, password, full_name, email, phone])
+
+
+def get_all_customers():
+    return _select('SELECT * FROM "Customer" ORDER BY rowid')
+
+
+def login_user(username, password):
+    customer = _connect().execute(
+        'SELECT * FROM "Customer" WHERE "customerUsername" = ? ORDER BY rowid LIMIT 1', (username,)
+    ).fetchone()
+    if customer is not None:
+        if str(customer["customerPassword"]) == password:
+            return "Customer", customer["customerUsername"], customer["customerEmail"]
+        return None, None, None
+
+    pharmacist = _connect().execute(
+        'SELECT * FROM "Pharmacist" WHERE "pharmacistUsername" = ? ORDER BY rowid LIMIT 1', (username,)
+    ).fetchone()
+    if pharmacist is not None and str(pharmacist["pharmacistPassword"]) == password:
+        return "Pharmacist", pharmacist["pharmacistUsername"], pharmacist["pharmacistEmail"]
+    return None, None, None
+
+
+def get_customer_id(username):
+    row = _connect().execute(
+        'SELECT "customerID" FROM "Customer" WHERE "customerUsername" = ? ORDER BY rowid LIMIT 1', (username,)
+    ).fetchone()
+    return str(row[0]) if row is not None else None
+
+
+def check_email_exists(email):
+    row = _connect().execute(
+        'SELECT 1 FROM "Customer" WHERE lower(trim("customerEmail")) = ? LIMIT 1', (str(email).strip().lower(),)
+    ).fetchone()
+    return row is not None
+
+
+# --------------------------------------------
+# Schedule and appointments
+
+_SLOT_MATCH = 'lower(trim("availableDate")) = ? AND lower(trim("availableTimeslot")) = ?'
+# Slot s is held by an appointment that wasn't cancelled, compared like _SLOT_MATCH
+_SLOT_BOOKED = (
+    'EXISTS (SELECT 1 FROM "Appointment" a WHERE a."appointmentStatus" != \'Cancelled\''
+    ' AND lower(trim(a."appointmentDate")) = lower(trim(s."availableDate"))'
+    ' AND lower(trim(a."appointmentTime")) = lower(trim(s."availableTimeslot")))'
+)
+
+
+def load_sheets(sheet_names):
+    # Tables are local; there is nothing to fetch ahead of a page
+    return None
+
+
+def _slot_params(date, time):
+    return str(date).strip().lower(), str(time).strip().lower()
+
+
+def get_pharmacist_schedule():
+    return _select('SELECT * FROM "Schedule" ORDER BY rowid')
+
+
+def slot_exists(date, time):
+    row = _connect().execute(f'SELECT 1 FROM "Schedule" WHERE {_SLOT_MATCH} LIMIT 1', _slot_params(date, time)).fetchone()
+    return row is not None
+
+
+def update_schedule(date, time):
+    with _write("Schedule") as conn:
+        _insert(conn, "Schedule", [date, time])
+    analytics.record_slots([(date, time)], 1)
+
+
+def add_schedule_slots(slots):
+    # Same contract as google_sheets.add_schedule_slots
+    with _write("Schedule") as conn:
+        taken = {tuple(row) for row in conn.execute(
+            'SELECT lower(trim("availableDate")), lower(trim("availableTimeslot")) FROM "Schedule"'
+        )}
+        taken |= {tuple(row) for row in conn.execute(
+            'SELECT lower(trim("appointmentDate")), lower(trim("appointmentTime")) FROM "Appointment"'
+            ' WHERE "appointmentStatus" != \'Cancelled\''
+        )}
+        rows = []
+        for date, time in slots:
+            key = _slot_params(date, time)
+            if key not in taken:
+                taken.add(key)
+                rows.append([str(date), time])
+        for row in rows:
+            _insert(conn, "Schedule", row)
+    analytics.record_slots(rows, 1)
+    return rows
+
+
+def remove_schedule_slot(date, time):
+    with _write("Schedule") as conn:
+        cur = conn.execute(
+            f'DELETE FROM "Schedule" WHERE rowid = (SELECT rowid FROM "Schedule" WHERE {_SLOT_MATCH} ORDER BY rowid LIMIT 1)',
+            _slot_params(date, time),
+        )
+    if cur.rowcount:
+        analytics.record_slots([(date, time)], -1)
+
+
+def remove_schedule_slots(slots):
+    removed = []
+    with _write("Schedule") as conn:
+        for date, time in slots:
+            cur = conn.execute(
+                f'DELETE FROM "Schedule" WHERE rowid = (SELECT rowid FROM "Schedule" WHERE {_SLOT_MATCH} ORDER BY rowid LIMIT 1)',
+                _slot_params(date, time),
+            )
+            if cur.rowcount:
+                removed.append((date, time))
+    analytics.record_slots(removed, -1)
+    return removed
+
+
+def restore_schedule_slot(date, time):
+    with _write("Schedule") as conn:
+        if conn.execute(f'SELECT 1 FROM "Schedule" WHERE {_SLOT_MATCH} LIMIT 1', _slot_params(date, time)).fetchone():
+            return  # already exists
+        _insert(conn, "Schedule", [date, time])
+    analytics.record_slots([(date, time)], 1)
+
+
+def save_appointment(data, referral_path=None):
+    # Same contract as google_sheets.save_appointment: None if the slot is gone
+    with _write("Appointment", "Schedule") as conn:
+        slot = conn.execute(
+            f'SELECT rowid FROM "Schedule" WHERE {_SLOT_MATCH} ORDER BY rowid LIMIT 1', _slot_params(data[1], data[2])
+        ).fetchone()
+        if slot is None or conn.execute(
+            f'SELECT 1 FROM "Schedule" s WHERE s.rowid = ? AND {_SLOT_BOOKED}', (slot[0],)
+        ).fetchone():
+            return None
+        appointment_id = _next_value(conn, "appointmentID")
+        _insert(conn, "Appointment", [appointment_id] + data + [referral_path or ""])
+        conn.execute('DELETE FROM "Schedule" WHERE rowid = ?', (slot[0],))
+    analytics.record_booking(data[1], data[2], data[3])
+    return appointment_id
+
+
+def get_appointments():
+    return _select('SELECT * FROM "Appointment" ORDER BY rowid')
+
+
+def update_appointments(changes):
+    updated = 0
+    moved = []  # (before, after) for the analytics counts
+    with _write("Appointment") as conn:
+        columns = set(_columns(conn, "Appointment"))
+        for appointment_id, fields in changes.items():
+            fields = {col: value for col, value in fields.items() if value and col in columns}
+            if not fields:
+                continue
+            old = conn.execute('SELECT * FROM "Appointment" WHERE "appointmentID" = ?', (appointment_id,)).fetchone()
+            if old is not None:
+                old = dict(old)
+                moved.append((analytics.booking_key(old), analytics.booking_key({**old, **fields})))
+            assignments = ", ".join(f"{_quote(col)} = ?" for col in fields)
+            cur = conn.execute(
+                f'UPDATE "Appointment" SET {assignments} WHERE "appointmentID" = ?',
+                list(fields.values()) + [appointment_id],
+            )
+            updated += 1 if cur.rowcount else 0
+    analytics.record_changes(moved)
+    return updated
+
+
+def update_appointment_status(appointment_id, new_status=None, new_date=None, new_time=None):
+    update_appointments({
+        appointment_id: {
+            "appointmentStatus": new_status,
+            "appointmentDate": new_date,
+            "appointmentTime": new_time,
+        }
+    })
+
+
+def update_appointments_status(appointment_ids, new_status):
+    return update_appointments({appointment_id: {"appointmentStatus": new_status} for appointment_id in appointment_ids})
+
+
+def available_dates():
+    rows = _connect().execute(
+        f'SELECT DISTINCT s."availableDate" FROM "Schedule" s WHERE NOT {_SLOT_BOOKED}'
+        ' ORDER BY s."availableDate"'
+    )
+    return [str(row[0]) for row in rows]
+
+
+def available_times(date):
+    rows = _connect().execute(
+        f'SELECT DISTINCT s."availableTimeslot" FROM "Schedule" s WHERE lower(trim(s."availableDate")) = ? AND NOT {_SLOT_BOOKED}',
+        (str(date).strip().lower(),),
+    )
+    return sorted((str(row[0]) for row in rows), key=timeslot_sort_key)
+
+
+# --------------------------------------------
+# Reports
+
+def archive_rows(sheet_name, archive_for, limit=None):
+    # Finished rows stay in their indexed tables; there is nothing to move
+    return 0
+
+
+def archived_records(sheet_name):
+    return []
+
+
+def save_report(report_row):
+    with _write("Report") as conn:
+        _insert(conn, "Report", report_row)
+
+
+def get_all_reports():
+    return _select('SELECT * FROM "Report" ORDER BY rowid')
+
+
+# --------------------------------------------
+# Bulk import and export
+
+def sheet_headers(sheet_name):
+    return _columns(_connect(), sheet_name)
+
+
+def import_rows(sheet_name, rows):
+    with _write(sheet_name) as conn:
+        headers = _columns(conn, sheet_name)
+        placeholders = ", ".join("?" for _ in headers)
+        conn.executemany(
+            f"INSERT INTO {_quote(sheet_name)} VALUES ({placeholders})",
+            [(list(row) + [""] * len(headers))[:len(headers)] for row in rows],
+        )
+
+
+def read_pages(sheet_name, page_rows):
+    conn = _connect()
+    cursor = conn.execute(f"SELECT * FROM {_quote(sheet_name)} ORDER BY rowid")
+    page = [[column[0] for column in cursor.description]]
+    while True:
+        page += [["" if v is None else v for v in row] for row in cursor.fetchmany(page_rows - len(page))]
+        if len(page) < page_rows:
+            if page:
+                yield page
+            return
+        yield page
+        page = []
+
+
+# --------------------------------------------
+# Spreadsheet mirror
+
+def _push(table):
+    conn = _connect()
+    headers = _columns(conn, table)
+    values = [headers] + [
+        ["" if v is None else v for v in row]
+        for row in conn.execute(f"SELECT * FROM {_quote(table)} ORDER BY rowid")
+    ]
+    ws = open_worksheet(table)
+    governor.write("update", table, ws.update, range_name="A1", values=values)
+    # Clear whatever is left below the pushed rows
+    governor.write("batch_clear", table, ws.batch_clear, [f"A{len(values) + 1}:ZZ"])
+
+
+def mirror_now():
+    with _dirty_lock:
+        tables = sorted(_dirty)
+        _dirty.clear()
+    for table in tables:
+        try:
+            _push(table)
+        except Exception as e:
+            with _dirty_lock:
+                _dirty.add(table)
+            print(f"Mirroring {table} to Google Sheets failed: {e}")
+
+
+def _run_mirror():
+    while True:
+        time.sleep(MIRROR_INTERVAL)
+        mirror_now()
+
+
+def _start_mirror():
+    global _mirror
+    if SHEETS_MIRROR and _mirror is None:
+        _mirror = threading.Thread(target=_run_mirror, name="sqlite-mirror", daemon=True)
+        _mirror.start()
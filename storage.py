@@ -0,0 +1,33 @@
+# storage.py
+# Picks the storage engine behind the data-layer functions. With the default
+# STORAGE_BACKEND = "sheets" everything reads and writes Google Sheets as
+# before; with "sqlite" the same function names are served by sqlite_store,
+# a local database with real indexes that can mirror itself to the sheets.
+import functools
+import streamlit as st
+
+STORAGE_BACKEND = str(st.secrets.get("STORAGE_BACKEND", "sheets")).lower()
+BACKENDS = ("sheets", "sqlite")
+
+if STORAGE_BACKEND not in BACKENDS:
+    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}; expected one of {BACKENDS}")
+
+
+def active_engine():
+    # None means the Google Sheets implementation itself
+    if STORAGE_BACKEND == "sqlite":
+        import sqlite_store
+        return sqlite_store
+    return None
+
+
+def pluggable(fn):
+    # Keeps the decorated function's name and signature as the public API; when
+    # another engine is active the call goes to its function of the same name
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        engine = active_engine()
+        if engine is None:
+            return fn(*args, **kwargs)
+        return getattr(engine, fn.__name__)(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,171 @@
+# tables.py
+# Typed, columnar views of the worksheets for the pages that filter and list
+# rows. IDs are integer columns, statuses and repeated strings are categoricals,
+# and dates and timeslots get parsed companion columns for sorting. A frame is
+# built once per record list (the cache swaps in a new list whenever a sheet
+# changes) and shared by every session, so treat it as read-only.
+import threading
+
+import pandas as pd
+
+from availability import timeslot_sort_key
+from google_sheets import get_appointments, get_all_customers, get_pharmacist_schedule, get_all_reports, archived_records
+
+STATUSES = ["Pending Confirmation", "Confirmed", "Rescheduled", "Cancelled", "Completed"]
+ACTIVE_STATUSES = ["Pending Confirmation", "Confirmed", "Rescheduled"]
+PAST_STATUSES = ["Cancelled", "Completed"]
+
+_lock = threading.Lock()
+_frames = {}  # table name -> (record list the frame was built from, frame)
+
+
+def _id_column(values):
+    # Integer IDs where every value is one, strings otherwise
+    try:
+        return pd.Series([None if v == "" else int(v) for v in values], dtype="Int64")
+    except (TypeError, ValueError):
+        return pd.Series([str(v) for v in values], dtype="string")
+
+
+def _text_column(values):
+    return pd.Series([str(v) for v in values], dtype="category")
+
+
+def _status_column(values):
+    values = [str(v) for v in values]
+    extra = sorted(set(values) - set(STATUSES))
+    return pd.Series(pd.Categorical(values, categories=STATUSES + extra))
+
+
+def _date_column(values):
+    return pd.to_datetime(pd.Series([str(v) for v in values]), format="%Y-%m-%d", errors="coerce")
+
+
+def _slot_column(values):
+    # Minutes from midnight of the slot start, -1 when unparsable
+    starts = {v: timeslot_sort_key(v) for v in set(map(str, values))}
+    return pd.Series([starts[str(v)][1] if starts[str(v)][0] == 0 else -1 for v in values], dtype="int16")
+
+
+def _build(records, columns):
+    # columns: {name: converter}; missing fields read as ""
+    return pd.DataFrame({
+        name: convert([r.get(name, "") for r in records]) for name, convert in columns.items()
+    })
+
+
+def _memoized(name, records, build):
+    with _lock:
+        cached = _frames.get(name)
+        if cached is not None and cached[0] is records:
+            return cached[1]
+    frame = build(records)
+    with _lock:
+        _frames[name] = (records, frame)
+    return frame
+
+
+def _build_appointments(records):
+    frame = _build(records, {
+        "appointmentID": _id_column,
+        "customerID": _id_column,
+        "appointmentDate": _text_column,
+        "appointmentTime": _text_column,
+        "appointmentStatus": _status_column,
+        "appointmentReferralLetter": _text_column,
+    })
+    frame["date"] = _date_column(frame["appointmentDate"])
+    frame["slot"] = _slot_column(frame["appointmentTime"])
+    return frame
+
+
+def _build_customers(records):
+    return _build(records, {
+        "customerID": _id_column,
+        "customerUsername": _text_column,
+        "customerName": _text_column,
+        "customerEmail": _text_column,
+        "customerNumber": _text_column,
+    })
+
+
+def _build_schedule(records):
+    frame = _build(records, {"availableDate": _text_column, "availableTimeslot": _text_column})
+    frame["date"] = _date_column(frame["availableDate"])
+    frame["slot"] = _slot_column(frame["availableTimeslot"])
+    return frame
+
+
+def _build_reports(records):
+    return _build(records, {
+        "reportID": _id_column,
+        "customerID": _id_column,
+        "appointmentID": _id_column,
+        "reportDate": _text_column,
+        "reportContent": lambda values: pd.Series([str(v) for v in values], dtype="string"),
+    })
+
+
+def appointments_frame():
+    return _memoized("Appointment", get_appointments(), _build_appointments)
+
+
+def archived_appointments_frame():
+    # History from the monthly archive sheets; read on demand, not memoized
+    return _build_appointments(archived_records("Appointment"))
+
+
+def archived_schedule_frame():
+    # Past slots from the monthly archive sheets; read on demand, not memoized
+    return _build_schedule(archived_records("Schedule"))
+
+
+def customers_frame():
+    # Passwords are left out on purpose
+    return _memoized("Customer", get_all_customers(), _build_customers)
+
+
+def schedule_frame():
+    return _memoized("Schedule", get_pharmacist_schedule(), _build_schedule)
+
+
+def reports_frame():
+    return _memoized("Report", get_all_reports(), _build_reports)
+
+
+def id_mask(frame, column, value):
+    # Rows whose ID column equals `value`, which may be an int or a string
+    ids = frame[column]
+    if pd.api.types.is_integer_dtype(ids.dtype):
+        number = pd.to_numeric(pd.Series([str(value)]), errors="coerce")[0]
+        if pd.isna(number):
+            return pd.Series(False, index=frame.index)
+        return (ids == int(number)).fillna(False).astype(bool)
+    return (ids == str(value)).fillna(False).astype(bool)
+
+
+def id_options(frame, column):
+    # Distinct IDs as strings, in numeric order when the column is numeric
+    ids = frame[column].dropna().unique()
+    return [str(v) for v in sorted(ids)]
+
+
+def with_customers(appointments):
+    # `appointments` plus the customer's name, email and number columns
+    customers = customers_frame()[["customerID", "customerName", "customerEmail", "customerNumber"]]
+    customers = customers.drop_duplicates("customerID")
+    left, right = appointments["customerID"], customers["customerID"]
+    if left.dtype != right.dtype:
+        left, right = left.astype("string"), right.astype("string")
+    return (
+        appointments.assign(_key=left)
+        .merge(customers.drop(columns="customerID").assign(_key=right), on="_key", how="left")
+        .drop(columns="_key")
+        .set_index(appointments.index)
+    )
+
+
+def rows(frame, columns=None):
+    # Plain dicts for the handful of rows a page actually renders
+    frame = frame if columns is None else frame[columns]
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
@@ -0,0 +1,63 @@
+# user_directory.py
+# Username and email lookups for login and registration. Customer and
+# Pharmacist are loaded together in one batched read; the dicts below are
+# rebuilt only when a sheet is reloaded, and new registrations appended by
+# the app are indexed on their own.
+import threading
+
+import sheet_cache
+
+_lock = threading.Lock()
+_state = {
+    "customer_generation": None,
+    "customer_count": 0,
+    "pharmacist_version": None,
+    "by_username": {},        # username -> (role, record)
+    "customer_by_email": {},  # lower-cased email -> customer record
+}
+
+
+def _index_customers(records):
+    by_username = _state["by_username"]
+    by_email = _state["customer_by_email"]
+    for record in records:
+        by_username.setdefault(str(record.get("customerUsername")), ("Customer", record))
+        by_email.setdefault(str(record.get("customerEmail", "")).strip().lower(), record)
+
+
+def _refresh():
+    sheet_cache.prefetch(["Customer", "Pharmacist"])
+    customers = sheet_cache.get_records("Customer")
+    pharmacists = sheet_cache.get_records("Pharmacist")
+    customer_generation = sheet_cache.generation("Customer")
+    pharmacist_version = sheet_cache.version("Pharmacist")
+
+    with _lock:
+        appended_only = (
+            _state["customer_generation"] == customer_generation
+            and _state["pharmacist_version"] == pharmacist_version
+            and len(customers) >= _state["customer_count"]
+        )
+        if appended_only:
+            _index_customers(customers[_state["customer_count"]:])
+        else:
+            _state["by_username"] = {}
+            _state["customer_by_email"] = {}
+            # Customers first: on a clash the original login checked them first too
+            _index_customers(customers)
+            for record in pharmacists:
+                _state["by_username"].setdefault(str(record.get("pharmacistUsername")), ("Pharmacist", record))
+
+        _state["customer_generation"] = customer_generation
+        _state["customer_count"] = len(customers)
+        _state["pharmacist_version"] = pharmacist_version
+        return _state
+
+
+def find_user(username):
+    # (role, record) for a customer or pharmacist username, or None
+    return _refresh()["by_username"].get(str(username))
+
+
+def find_customer_by_email(email):
+    return _refresh()["customer_by_email"].get(str(email).strip().lower())
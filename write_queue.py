@@ -0,0 +1,163 @@
+# write_queue.py
+# Optional write-behind mode for append-only sheets. Rows are journaled to a
+# local SQLite file and the caller returns at once; a background thread sends
+# each sheet's pending rows in one append_rows call, retrying with backoff.
+# Until a row is flushed, reads of that sheet still include it.
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+import streamlit as st
+
+from sheets_client import worksheet as open_worksheet
+import request_governor as governor
+import sheet_cache
+
+WRITE_BEHIND = str(st.secrets.get("WRITE_BEHIND", "false")).lower() in ("1", "true", "yes")
+WRITE_QUEUE_PATH = st.secrets.get("WRITE_QUEUE_PATH", "write_queue.db")
+FLUSH_INTERVAL = float(st.secrets.get("WRITE_FLUSH_SECONDS", 2))
+MAX_BACKOFF = 120
+CLAIM_SECONDS = 60
+
+# Sheets whose rows are never addressed by position, so they can be appended late.
+# Schedule and Appointment stay synchronous: booking needs their row numbers.
+QUEUEABLE_SHEETS = {"Customer", "Report"}
+
+_lock = threading.Lock()
+_wake = threading.Event()
+_pending = {}    # sheet name -> [(journal id, row)], mirror of the journal
+_retry_at = {}   # sheet name -> monotonic time of next attempt
+_failures = {}   # sheet name -> consecutive failed flushes
+_worker = None
+_owner = uuid.uuid4().hex
+
+
+def enabled(sheet_name):
+    return WRITE_BEHIND and sheet_name in QUEUEABLE_SHEETS
+
+
+def _connect():
+    conn = sqlite3.connect(WRITE_QUEUE_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS pending ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " sheet TEXT NOT NULL,"
+        " row TEXT NOT NULL,"
+        " claimed_by TEXT,"
+        " claimed_until REAL NOT NULL DEFAULT 0)"
+    )
+    return conn
+
+
+def _start():
+    # Replay anything a previous run journaled but never flushed, then start the worker
+    global _worker
+    if _worker is not None:
+        return
+    conn = _connect()
+    try:
+        for row_id, sheet_name, row in conn.execute("SELECT id, sheet, row FROM pending ORDER BY id"):
+            _pending.setdefault(sheet_name, []).append((row_id, json.loads(row)))
+    finally:
+        conn.close()
+    for sheet_name in _pending:
+        sheet_cache.touch(sheet_name)
+    _worker = threading.Thread(target=_run, name="write-behind", daemon=True)
+    _worker.start()
+
+
+def enqueue(sheet_name, rows):
+    conn = _connect()
+    try:
+        with _lock:
+            _start()
+            ids = []
+            for row in rows:
+                cur = conn.execute("INSERT INTO pending (sheet, row) VALUES (?, ?)", (sheet_name, json.dumps(row)))
+                ids.append(cur.lastrowid)
+            _pending.setdefault(sheet_name, []).extend(zip(ids, rows))
+    finally:
+        conn.close()
+    sheet_cache.touch(sheet_name)
+    _wake.set()
+
+
+def pending_rows(sheet_name):
+    with _lock:
+        return [row for _, row in _pending.get(sheet_name, [])]
+
+
+def _claim(conn, sheet_name):
+    # Another app process sharing the journal must not flush the same rows
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "UPDATE pending SET claimed_by = ?, claimed_until = ? WHERE sheet = ? AND claimed_until < ?",
+            (_owner, now + CLAIM_SECONDS, sheet_name, now),
+        )
+        claimed = conn.execute(
+            "SELECT id, row FROM pending WHERE sheet = ? AND claimed_by = ? ORDER BY id",
+            (sheet_name, _owner),
+        ).fetchall()
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return [(row_id, json.loads(row)) for row_id, row in claimed]
+
+
+def _flush(conn, sheet_name):
+    claimed = _claim(conn, sheet_name)
+    if not claimed:
+        # Rows replayed at startup may have been flushed by another process since
+        journaled = {row_id for (row_id,) in conn.execute("SELECT id FROM pending WHERE sheet = ?", (sheet_name,))}
+        with _lock:
+            _pending[sheet_name] = [item for item in _pending.get(sheet_name, []) if item[0] in journaled]
+        sheet_cache.touch(sheet_name)
+        return
+    rows = [row for _, row in claimed]
+    planned = sheet_cache.version(sheet_name)
+    governor.write("append_rows", sheet_name, open_worksheet(sheet_name).append_rows, rows)
+
+    ids = [row_id for row_id, _ in claimed]
+    conn.executemany("DELETE FROM pending WHERE id = ?", [(row_id,) for row_id in ids])
+    sent = set(ids)
+    # Move the rows from the pending overlay into the cached sheet together
+    with _lock:
+        sheet_cache.append_rows(sheet_name, rows, planned)
+        _pending[sheet_name] = [item for item in _pending.get(sheet_name, []) if item[0] not in sent]
+
+
+def flush_all():
+    conn = _connect()
+    try:
+        with _lock:
+            sheet_names = [name for name, items in _pending.items() if items]
+        for sheet_name in sheet_names:
+            if time.monotonic() < _retry_at.get(sheet_name, 0):
+                continue
+            try:
+                _flush(conn, sheet_name)
+                _failures.pop(sheet_name, None)
+            except Exception as e:
+                failures = _failures.get(sheet_name, 0) + 1
+                _failures[sheet_name] = failures
+                delay = min(MAX_BACKOFF, 2 ** failures) * random.uniform(0.5, 1.5)
+                _retry_at[sheet_name] = time.monotonic() + delay
+                print(f"Write-behind flush of {sheet_name} failed ({e}); retrying in {delay:.0f}s")
+    finally:
+        conn.close()
+
+
+def _run():
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        flush_all()
+
+
+sheet_cache.add_overlay(pending_rows)